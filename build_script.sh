@@ -1,11 +1,153 @@
-# Clone repository
-git clone https://github.com/Qualcomm-AI-research/gauge-equivariant-mesh-cnn
+# Revision of the repository to build, the full commit sha. Required unless
+# build_image.py attaches the sources as source.tar.gz (--source-dir).
+SOURCE_REVISION=
 
-# Move def file and launch build
-mv gauge-equivariant-mesh-cnn.def gauge-equivariant-mesh-cnn/
-cd gauge-equivariant-mesh-cnn/
-sudo apptainer build ../gauge-equivariant-mesh-cnn.sif gauge-equivariant-mesh-cnn.def
+# Cores available to the build, passed by build_image.py in the job command
+BUILD_CORES=${BUILD_CORES:-$(nproc)}
+
+# SIF squashfs compression as algorithm[:level], passed by build_image.py
+SIF_COMPRESSION=${SIF_COMPRESSION:-gzip}
+squashfs_args="-processors $BUILD_CORES -comp ${SIF_COMPRESSION%%:*}"
+case "$SIF_COMPRESSION" in
+  *:*) squashfs_args="$squashfs_args -Xcompression-level ${SIF_COMPRESSION#*:}" ;;
+esac
+
+# Apptainer 1.0.1 cannot pass arguments to mksquashfs, it runs the first
+# mksquashfs on its PATH. This wrapper, put first on the PATH of the SIF build,
+# replaces the compression and processor options apptainer sets.
+mkdir bin
+cat > bin/mksquashfs <<EOF
+#!/bin/sh
+touch "$PWD/mksquashfs.used"
+skip=
+for arg do
+  shift
+  if [ -n "\$skip" ]; then skip=; continue; fi
+  case "\$arg" in
+    -comp|-Xcompression-level|-processors) skip=1; continue ;;
+  esac
+  set -- "\$@" "\$arg"
+done
+exec $(PATH="$PATH:/usr/sbin:/sbin" command -v mksquashfs) "\$@" $squashfs_args
+EOF
+chmod +x bin/mksquashfs
+
+# Fetch sources: use the tree pre-packed by `build_image.py --source-dir` when
+# present, otherwise fetch only the pinned revision without its history
+if [ ! -f source.tar.gz ] &&
+  ! expr "$SOURCE_REVISION" : '[0-9a-f]\{40\}$' > /dev/null; then
+  echo "ERROR: set SOURCE_REVISION in the build script to a full commit sha" \
+    "or pass --source-dir to build_image.py, not building unpinned sources" >&2
+  exit 1
+fi
+mkdir gauge-equivariant-mesh-cnn
+if [ -f source.tar.gz ]; then
+  tar -xzf source.tar.gz -C gauge-equivariant-mesh-cnn
+  rm source.tar.gz
+else
+  cd gauge-equivariant-mesh-cnn/
+  git init -q
+  git remote add origin https://github.com/Qualcomm-AI-research/gauge-equivariant-mesh-cnn
+  git fetch -q --depth 1 origin "$SOURCE_REVISION"
+  git checkout -q FETCH_HEAD
+  cd ..
+fi
+
+# Restore the base image layers cached by a previous build, attached by
+# build_image.py as apptainer-cache.tar
+export APPTAINER_CACHEDIR="$PWD/apptainer-cache"
+mkdir -p "$APPTAINER_CACHEDIR"
+if [ -f apptainer-cache.tar ]; then
+  tar -xf apptainer-cache.tar -C "$APPTAINER_CACHEDIR"
+  rm apptainer-cache.tar
+fi
+find "$APPTAINER_CACHEDIR" -type f | sort > apptainer-cache.before
+
+# Restore the wheels built by previous builds, attached by build_image.py as
+# wheelhouse.tar. The wheelhouse is copied into the image at /wheelhouse with
+# the sources, the marker file tells %post it is there.
+mkdir -p wheelhouse
+if [ -f wheelhouse.tar ]; then
+  tar -xf wheelhouse.tar -C wheelhouse
+  rm wheelhouse.tar
+fi
+touch wheelhouse/.wheelhouse
+ls wheelhouse | sort > wheelhouse.before
 
-# Delete all not SIF files, so only image file is offloaded
+# Sample peak memory use and CPU time during the build. build_image.py reads
+# the BUILD_USAGE line from the process output to size later builds.
+sample_memory() {
+  while sleep 5; do
+    free -m | awk '/^Mem:/ {print $3}'
+  done
+}
+cpu_ticks() {
+  awk '/^cpu / {print $2 + $3 + $4 + $7 + $8, $2 + $3 + $4 + $5 + $6 + $7 + $8}' \
+    /proc/stat
+}
+sample_memory > memory.samples &
+sampler=$!
+cpu_before=$(cpu_ticks)
+build_start=$(date +%s)
+
+# Move def file, setting the build job's core count for compilation in its
+# %post and recording the compression in its %labels (Apptainer 1.0.1 has no
+# build arguments), and launch build. The image is built as a sandbox first,
+# so the wheels harvested into /wheelhouse can be moved out of it before it is
+# packed into the SIF.
+awk -v cores="$BUILD_CORES" -v compression="$SIF_COMPRESSION" '
+  { print }
+  /^%post/ {
+    print "  export MAX_JOBS=" cores
+    print "  export MAKEFLAGS=-j" cores
+    print "  export CMAKE_BUILD_PARALLEL_LEVEL=" cores
+  }
+  /^%labels/ { print "  org.rescale.sif.compression " compression; labels = 1 }
+  END {
+    if (!labels) print "\n%labels\n  org.rescale.sif.compression " compression
+  }
+' gauge-equivariant-mesh-cnn.def > gauge-equivariant-mesh-cnn/gauge-equivariant-mesh-cnn.def
+rm gauge-equivariant-mesh-cnn.def
+cp -r wheelhouse gauge-equivariant-mesh-cnn/wheelhouse
+cd gauge-equivariant-mesh-cnn/
+sudo APPTAINER_CACHEDIR="$APPTAINER_CACHEDIR" \
+  apptainer build --sandbox ../rootfs gauge-equivariant-mesh-cnn.def
 cd ..
-find . -type f -not -name 'gauge-equivariant-mesh-cnn.sif' -delete
\ No newline at end of file
+if [ -d rootfs/wheelhouse ]; then
+  sudo find rootfs/wheelhouse -name '*.whl' -exec cp -n {} wheelhouse/ \;
+  sudo rm -rf rootfs/wheelhouse
+fi
+sudo env APPTAINER_CACHEDIR="$APPTAINER_CACHEDIR" PATH="$PWD/bin:$PATH" \
+  apptainer build gauge-equivariant-mesh-cnn.sif rootfs
+sudo rm -rf rootfs
+if [ ! -f mksquashfs.used ]; then
+  echo "WARNING: apptainer did not run the mksquashfs wrapper, the SIF is" \
+    "compressed with its default settings instead of $SIF_COMPRESSION"
+fi
+
+kill "$sampler"
+echo "$cpu_before $(cpu_ticks)" | awk \
+  -v cores="$BUILD_CORES" \
+  -v seconds="$(( $(date +%s) - build_start ))" \
+  -v peak="$(sort -n memory.samples | tail -n 1)" \
+  '{ busy = $3 - $1; total = $4 - $2;
+     printf "BUILD_USAGE cores=%d build_seconds=%d peak_memory_mb=%d cpu_utilization=%.2f\n",
+       cores, seconds, peak, total ? busy / total : 0 }'
+
+# Save the wheelhouse for later builds only when new wheels were harvested
+ls wheelhouse | sort > wheelhouse.after
+if ! cmp -s wheelhouse.before wheelhouse.after; then
+  tar -cf wheelhouse.tar -C wheelhouse .
+fi
+sudo rm -rf wheelhouse
+
+# Save the layer cache for later builds only when new layers were pulled
+sudo find "$APPTAINER_CACHEDIR" -type f | sort > apptainer-cache.after
+if ! cmp -s apptainer-cache.before apptainer-cache.after; then
+  sudo tar -cf apptainer-cache.tar -C "$APPTAINER_CACHEDIR" .
+fi
+sudo rm -rf "$APPTAINER_CACHEDIR"
+
+# Delete all not SIF files, so only image file and caches are offloaded
+find . -type f -not -name 'gauge-equivariant-mesh-cnn.sif' \
+  -not -name 'apptainer-cache.tar' -not -name 'wheelhouse.tar' -delete
\ No newline at end of file
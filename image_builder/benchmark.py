@@ -0,0 +1,456 @@
+"""Benchmarks for build_image.py against the local stand-in Rescale API
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shlex
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+import build_image
+from fake_rescale import INSTANT_TIMELINE, FakeRescaleServer
+
+
+class _UnpooledClient(build_image.RescaleClient):
+    """Issues every call through module-level requests, as before pooling"""
+
+    def _send(self, method: str, path: str, **kwargs):
+        headers = dict(self.session.headers)
+        headers.update(kwargs.pop("headers", None) or {})
+        return requests.request(
+            method, f"{self.base_url}{path}", headers=headers, **kwargs
+        )
+
+
+# Synthetic (elapsed seconds, job status, cluster status) timelines. Recorded
+# ones can be produced with `build_image.py --record-timeline`.
+TIMELINES = {
+    "short": [
+        (0, "Pending", None),
+        (20, "Queued", None),
+        (131, "Validated", "Starting"),
+        (437, "Executing", "Started"),
+        (1043, "Stopping", "Stopping"),
+        (1097, "Completed", "Stopped"),
+    ],
+    "long-queue": [
+        (0, "Pending", None),
+        (20, "Queued", None),
+        (2714, "Validated", "Starting"),
+        (3088, "Executing", "Started"),
+        (5479, "Stopping", "Stopping"),
+        (5563, "Completed", "Stopped"),
+    ],
+}
+
+COMPRESSION_SETTINGS = ["gzip", "gzip:1", "lz4", "zstd:3", "zstd:19"]
+
+
+class _ReplayResponse:
+    def __init__(self, status_code: int, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class _ReplayClient:
+    """Serves job and cluster statuses from a timeline on a virtual clock"""
+
+    def __init__(self, timeline):
+        self.timeline = sorted(timeline)
+        self.now = 0.0
+        self.polls = 0
+
+    async def sleep(self, seconds: float):
+        self.now += seconds
+
+    def clock(self):
+        return self.now
+
+    def get(self, _endpoint: str, path: str, **_kwargs):
+        self.polls += 1
+        current = [entry for entry in self.timeline if entry[0] <= self.now][-1]
+        if path.endswith("/cluster_statuses/"):
+            if current[2] is None:
+                return _ReplayResponse(404)
+            return _ReplayResponse(200, {"results": [{"status": current[2]}]})
+        return _ReplayResponse(200, {"results": [{"status": current[1]}]})
+
+
+def replay_timeline(policy: build_image.PollPolicy, timeline):
+    """Runs _monitor_job over a status timeline on a virtual clock
+
+    Returns the number of API requests issued and the delay between the job
+    completing and the monitor noticing it.
+    """
+    client = _ReplayClient(timeline)
+    build_image._monitor_job(
+        "replay", client, policy, sleep=client.sleep, clock=client.clock
+    )
+    completed = min(t for t, status, _ in timeline if status == "Completed")
+    return client.polls, client.now - completed
+
+
+def _jobspec(workdir: str, name: str = "bench"):
+    deffile = os.path.join(workdir, f"{name}.def")
+    buildscript = os.path.join(workdir, f"{name}.sh")
+    with open(deffile, "w", encoding="utf-8") as file:
+        file.write("Bootstrap: docker\nFrom: alpine:3\n")
+    with open(buildscript, "w", encoding="utf-8") as file:
+        file.write("sudo apptainer build out.sif bench.def\n")
+    return build_image.JobSpec(
+        name,
+        deffile,
+        buildscript,
+        None,
+        build_image.ANALYSIS_CODE,
+        build_image.ANALYSIS_VERSION,
+        build_image.CORETYPE,
+        build_image.CORE_COUNT,
+        build_image.WALLTIME,
+    )
+
+
+def _run_once(client, jobspec):
+    file_ids = [
+        build_image._upload_file(path, client)
+        for path in (jobspec.buildscript_path, jobspec.deffile_path)
+    ]
+    job_id = build_image._create_build_job(file_ids, jobspec, client)
+    build_image._submit_build_job(job_id, client)
+    build_image._monitor_job(job_id, client)
+    build_image._link_outfile_with_folder(job_id, client)
+    build_image._display_process_output(job_id, client)
+
+
+def bench_pooling(runs: int):
+    """Handshakes and wall time per build run, unpooled vs pooled client"""
+    with tempfile.TemporaryDirectory() as workdir, FakeRescaleServer() as server:
+        jobspec = _jobspec(workdir)
+        apispec = build_image.ApiSpec(server.basehost, "bench", "http")
+        print(f"{'mode':<10}{'runs':>6}{'handshakes/run':>16}{'wall ms/run':>14}")
+        for mode, client_cls in (
+            ("before", _UnpooledClient),
+            ("after", build_image.RescaleClient),
+        ):
+            server.state.reset_counters()
+            start = time.perf_counter()
+            for _ in range(runs):
+                with client_cls(apispec) as client, contextlib.redirect_stdout(
+                    io.StringIO()
+                ):
+                    _run_once(client, jobspec)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{mode:<10}{runs:>6}{server.state.connections / runs:>16.1f}"
+                f"{elapsed * 1000 / runs:>14.1f}"
+            )
+
+
+def bench_polling(timeline_paths):
+    """Requests and completion detection delay per polling policy"""
+    timelines = dict(TIMELINES)
+    for path in timeline_paths:
+        with open(path, encoding="utf-8") as file:
+            timelines[os.path.basename(path)] = [tuple(e) for e in json.load(file)]
+
+    policies = {
+        "fixed-30s": lambda: build_image.FixedPollPolicy(30),
+        "adaptive": lambda: build_image.AdaptivePollPolicy(rng=random.Random(0)),
+    }
+    print(f"{'timeline':<16}{'policy':<12}{'requests':>10}{'detect delay s':>16}")
+    for name, timeline in timelines.items():
+        for policy_name, make_policy in policies.items():
+            requests_count, delay = replay_timeline(make_policy(), timeline)
+            print(f"{name:<16}{policy_name:<12}{requests_count:>10}{delay:>16.1f}")
+
+
+def bench_e2e(
+    images: int,
+    latency: float,
+    timeline: str,
+    time_scale: float,
+    poll_interval: float,
+    injections,
+    processed_injections=(),
+):
+    """End-to-end wall time, requests and bytes of single and batch builds
+
+    Every build runs against a stand-in server answering with ``latency``
+    seconds of delay, whose jobs follow ``timeline`` ``time_scale`` times
+    faster than real time. ``injections`` are (method, path regex, status,
+    times) failures injected before each mode; a status of "drop" resets the
+    connection. ``processed_injections`` fail requests after the server has
+    processed them. Each mode checks that every image ended up as exactly one
+    submitted job.
+    """
+    with tempfile.TemporaryDirectory() as workdir, FakeRescaleServer(
+        latency=latency,
+        timeline=INSTANT_TIMELINE if timeline == "instant" else TIMELINES[timeline],
+        time_scale=time_scale,
+    ) as server:
+        apispec = build_image.ApiSpec(server.basehost, "bench", "http")
+        print(
+            f"{'mode':<8}{'images':>8}{'wall s':>10}{'requests':>10}"
+            f"{'handshakes':>12}{'KB sent':>10}{'KB recv':>10}"
+        )
+        for mode, count in (("single", 1), ("batch", images)):
+            jobspecs = [_jobspec(workdir, f"{mode}{i}") for i in range(count)]
+            folder_cache = build_image.FolderCache(
+                os.path.join(workdir, f"{mode}-folders.json")
+            )
+            policy = build_image.FixedPollPolicy(poll_interval)
+            for processed, injected in (
+                (False, injections),
+                (True, processed_injections),
+            ):
+                for method, pattern, status, times in injected:
+                    server.state.inject_failure(
+                        method,
+                        pattern,
+                        None if status == "drop" else int(status),
+                        int(times),
+                        processed=processed,
+                    )
+            server.state.reset_counters()
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                if count == 1:
+                    build_image._build_image(
+                        jobspecs[0], apispec, policy=policy, folder_cache=folder_cache
+                    )
+                else:
+                    failed = build_image._build_images(
+                        jobspecs, apispec, policy=policy, folder_cache=folder_cache
+                    )
+                    if failed:
+                        raise Exception(f"Failed images: {', '.join(failed)}")
+            elapsed = time.perf_counter() - start
+            state = server.state
+            jobs = [
+                job
+                for job in state.jobs.values()
+                if job["spec"]["name"].startswith(mode)
+            ]
+            if len(jobs) != count or any(job["submitted"] is None for job in jobs):
+                raise Exception(
+                    f"{count} submitted jobs expected, got {len(jobs)} jobs of "
+                    f"which {sum(job['submitted'] is not None for job in jobs)} "
+                    "submitted"
+                )
+            print(
+                f"{mode:<8}{count:>8}{elapsed:>10.2f}{state.requests:>10}"
+                f"{state.connections:>12}{state.bytes_in / 1e3:>10.1f}"
+                f"{state.bytes_out / 1e3:>10.1f}"
+            )
+
+
+def bench_compression(
+    sandbox: str, settings, command: str, starts: int, apptainer: str = "apptainer"
+):
+    """Local SIF build time, size and start-up time per squashfs compression
+
+    Builds the same sandbox directory into a SIF once per setting, then
+    times ``starts`` runs of ``command`` in the container and reports the
+    median. Requires a local apptainer installation.
+    """
+    if shutil.which(apptainer) is None:
+        raise SystemExit(f"{apptainer} not found, the compression benchmark runs it")
+
+    for setting in settings:
+        build_image._parse_compression(setting)
+    with tempfile.TemporaryDirectory() as workdir:
+        sif = os.path.join(workdir, "bench.sif")
+        print(f"{'compression':<14}{'build s':>10}{'size MB':>10}{'start s':>10}")
+        for setting in settings:
+            start = time.perf_counter()
+            subprocess.run(
+                [
+                    apptainer,
+                    "build",
+                    "--force",
+                    "--mksquashfs-args",
+                    build_image._mksquashfs_args(setting),
+                    sif,
+                    sandbox,
+                ],
+                check=True,
+                capture_output=True,
+            )
+            build_time = time.perf_counter() - start
+
+            start_times = []
+            for _ in range(starts):
+                start = time.perf_counter()
+                subprocess.run(
+                    [apptainer, "exec", sif, *shlex.split(command)],
+                    check=True,
+                    capture_output=True,
+                )
+                start_times.append(time.perf_counter() - start)
+
+            print(
+                f"{setting:<14}{build_time:>10.1f}{os.path.getsize(sif) / 1e6:>10.1f}"
+                f"{statistics.median(start_times):>10.2f}"
+            )
+
+
+def bench_upload(size_mb: int, drops: int):
+    """Upload throughput and peak Python heap, with injected connection drops"""
+    with tempfile.TemporaryDirectory() as workdir, FakeRescaleServer() as server:
+        filepath = os.path.join(workdir, "context.tar")
+        with open(filepath, "wb") as file:
+            for _ in range(size_mb):
+                file.write(os.urandom(1 << 20))
+
+        server.state.drop_uploads = drops
+        server.state.drop_after = (size_mb << 20) // 2
+        apispec = build_image.ApiSpec(server.basehost, "bench", "http")
+        tracemalloc.start()
+        start = time.perf_counter()
+        with build_image.RescaleClient(apispec) as client:
+            build_image._upload_file(filepath, client)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"size:        {size_mb} MB")
+        print(f"drops:       {drops}")
+        print(f"sent:        {server.state.bytes_in / 1e6:.1f} MB")
+        print(f"wall:        {elapsed:.2f} s")
+        print(f"throughput:  {size_mb * (1 << 20) / elapsed / 1e6:.1f} MB/s")
+        print(f"peak heap:   {peak / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    all_args = argparse.ArgumentParser()
+    commands = all_args.add_subparsers(dest="command", required=True)
+
+    pooling_args = commands.add_parser("pooling", help=bench_pooling.__doc__)
+    pooling_args.add_argument("-r", "--runs", type=int, default=20)
+
+    polling_args = commands.add_parser("polling", help=bench_polling.__doc__)
+    polling_args.add_argument(
+        "-t",
+        "--timeline",
+        action="append",
+        default=[],
+        help="Recorded status timeline JSON file (repeatable)",
+    )
+
+    e2e_args = commands.add_parser("e2e", help=bench_e2e.__doc__.splitlines()[0])
+    e2e_args.add_argument(
+        "--images", type=int, default=10, help="Number of images of the batch build"
+    )
+    e2e_args.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds added to every response"
+    )
+    e2e_args.add_argument(
+        "--timeline",
+        choices=["instant", *TIMELINES],
+        default="short",
+        help="Status timeline followed by every simulated job",
+    )
+    e2e_args.add_argument(
+        "--time-scale",
+        type=float,
+        default=200,
+        help="How many times faster than real time simulated jobs progress",
+    )
+    e2e_args.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.5,
+        help="Status poll interval in seconds",
+    )
+    e2e_args.add_argument(
+        "--inject",
+        nargs=4,
+        action="append",
+        default=[],
+        metavar=("METHOD", "PATTERN", "STATUS", "TIMES"),
+        help="Fail the next TIMES requests matching METHOD and the path regex "
+        "PATTERN with STATUS, or 'drop' the connection (repeatable)",
+    )
+    e2e_args.add_argument(
+        "--inject-processed",
+        nargs=4,
+        action="append",
+        default=[],
+        metavar=("METHOD", "PATTERN", "STATUS", "TIMES"),
+        help="Like --inject, but the requests take effect before their response "
+        "is failed (repeatable)",
+    )
+
+    compression_args = commands.add_parser(
+        "compression", help=bench_compression.__doc__.splitlines()[0]
+    )
+    compression_args.add_argument(
+        "sandbox", help="Sandbox directory, e.g. from apptainer build --sandbox"
+    )
+    compression_args.add_argument(
+        "-c",
+        "--compression",
+        action="append",
+        default=None,
+        help="ALGORITHM[:LEVEL] setting to compare (repeatable, default: "
+        f"{', '.join(COMPRESSION_SETTINGS)})",
+    )
+    compression_args.add_argument(
+        "--start-command",
+        default="true",
+        help="Command whose run time in the container is measured as start-up",
+    )
+    compression_args.add_argument("--starts", type=int, default=5)
+
+    upload_args = commands.add_parser("upload", help=bench_upload.__doc__)
+    upload_args.add_argument("--size-mb", type=int, default=256)
+    upload_args.add_argument(
+        "--drops",
+        type=int,
+        default=1,
+        help="Number of uploads cut off halfway by the stand-in server",
+    )
+
+    args = vars(all_args.parse_args())
+
+    if args["command"] == "pooling":
+        bench_pooling(args["runs"])
+    elif args["command"] == "polling":
+        bench_polling(args["timeline"])
+    elif args["command"] == "e2e":
+        bench_e2e(
+            args["images"],
+            args["latency"],
+            args["timeline"],
+            args["time_scale"],
+            args["poll_interval"],
+            args["inject"],
+            args["inject_processed"],
+        )
+    elif args["command"] == "compression":
+        bench_compression(
+            args["sandbox"],
+            args["compression"] or COMPRESSION_SETTINGS,
+            args["start_command"],
+            args["starts"],
+        )
+    elif args["command"] == "upload":
+        bench_upload(args["size_mb"], args["drops"])
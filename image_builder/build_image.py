@@ -1,15 +1,40 @@
 """Apptainer Image Builder
 """
 
+import abc
 import argparse
+import asyncio
+import atexit
+import collections
+import contextlib
+import email.utils
+import gzip
+import hashlib
 import logging
+import math
+import mmap
 import sys
 import os
 import time
 import json
-from typing import List, NamedTuple
+import random
+import re
+import statistics
+import tarfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import yaml
+except ImportError:  # YAML manifests are optional, JSON always works
+    yaml = None
 
 BASE_HOST = "eu.rescale.com"
 ANALYSIS_CODE = "user_included_apptainer_container"
@@ -17,10 +42,94 @@ ANALYSIS_VERSION = "1.0.1"
 CORETYPE = "emerald"
 CORE_COUNT = 2
 WALLTIME = 2
+POOL_SIZE = 10
+WORKERS = 4
+UPLOAD_WORKERS = 4
+MAX_IN_FLIGHT = 8
+CACHE_DIR = os.environ.get(
+    "APPTAINER_BUILDER_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "apptainer_image_builder"),
+)
+UPLOAD_CACHE_MAX_ENTRIES = 500
+UPLOAD_CACHE_MAX_AGE_DAYS = 30
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_PROGRESS_INTERVAL = 10
+TAIL_LINES = 1000
+PAGE_SIZE = 100
+IMAGES_FOLDER_NAME = "apptainer_images"
+FOLDER_CACHE_TTL_DAYS = 7
+LINK_BATCH_SIZE = 50
+LINK_BATCH_DELAY = 30
+FOLLOW_INTERVAL = 10
+LAYER_CACHE_ARCHIVE = "apptainer-cache.tar"
+WHEELHOUSE_ARCHIVE = "wheelhouse.tar"
+HISTORY_MAX_RUNS = 50
+SIZING_MARGIN = 0.25
+# Builds at most this much slower than the fastest measured one count as fast
+SIZING_TIME_TOLERANCE = 0.1
+DEFAULT_CORE_OPTIONS = (1, 2, 4, 8, 16, 32, 64)
+SOURCE_ARCHIVE = "source.tar.gz"
+SOURCE_EXCLUDES = (".git", "__pycache__", ".mypy_cache", ".pytest_cache", ".tox")
+# (connect, read) timeouts in seconds per API endpoint group
+TIMEOUTS = {
+    "default": (10, 60),
+    "upload": (10, 600),
+    "jobs": (10, 60),
+    "status": (10, 30),
+    "files": (10, 60),
+    "folders": (10, 30),
+    "lines": (10, 120),
+}
+
+# Responses worth retrying; non-idempotent requests only retry the ones
+# returned before the request was processed
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_UNPROCESSED_STATUSES = (429, 503)
+# Total number of retries a client may spend over a build run
+RETRY_BUDGET = 100
+MONITOR_MAX_ERRORS = 10
 
 log = logging.getLogger(__name__)
 
 
+# Squashfs compressors apptainer can build SIFs with, and their level range
+COMPRESSION_LEVELS = {
+    "gzip": (1, 9),
+    "zstd": (1, 22),
+    "lz4": None,
+    "xz": None,
+    "lzo": (1, 9),
+}
+
+
+def _parse_compression(value: str) -> str:
+    """Validate an ``algorithm[:level]`` squashfs compression setting"""
+    algorithm, _, level = value.partition(":")
+    if algorithm not in COMPRESSION_LEVELS:
+        raise ValueError(
+            f"Unknown compression {algorithm!r}, "
+            f"expected one of {', '.join(COMPRESSION_LEVELS)}"
+        )
+    levels = COMPRESSION_LEVELS[algorithm]
+    if level:
+        if levels is None:
+            raise ValueError(f"{algorithm} compression takes no level")
+        if not level.isdigit() or not levels[0] <= int(level) <= levels[1]:
+            raise ValueError(
+                f"{algorithm} compression level must be {levels[0]}-{levels[1]}"
+            )
+    return value
+
+
+def _mksquashfs_args(compression: str) -> str:
+    """mksquashfs arguments selecting an ``algorithm[:level]`` compression"""
+    algorithm, _, level = compression.partition(":")
+    args = f"-comp {algorithm}"
+    if level:
+        args += f" -Xcompression-level {level}"
+    return args
+
+
 class JobSpec(NamedTuple):
     """Parameter holder for job related properties"""
 
@@ -33,6 +142,8 @@ class JobSpec(NamedTuple):
     coretype: str
     core_count: int
     walltime: int
+    input_paths: Tuple[str, ...] = ()
+    compression: Optional[str] = None
 
 
 class ApiSpec(NamedTuple):
@@ -40,6 +151,1133 @@ class ApiSpec(NamedTuple):
 
     basehost: str
     apikey: str
+    scheme: str = "https"
+
+
+class RetryPolicy(NamedTuple):
+    """Retry parameters for an API endpoint group"""
+
+    attempts: int = 5
+    backoff: float = 1
+    max_backoff: float = 60
+    jitter: float = 0.5
+
+
+RETRY_POLICIES = {
+    "default": RetryPolicy(),
+    "upload": RetryPolicy(attempts=5, backoff=2),
+    "status": RetryPolicy(attempts=6, backoff=2, max_backoff=120),
+}
+
+
+def _request_not_sent(error: Exception) -> bool:
+    """Whether a failed request certainly never reached the server"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _retry_after(response) -> float:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return 0
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return 0
+        return max(0, retry_at.timestamp() - time.time())
+
+
+class RescaleClient:
+    """Pooled keep-alive HTTP session shared by all Rescale API calls
+
+    A single instance is threaded through a build run so that every request
+    reuses the same connection pool and auth headers instead of paying a
+    fresh TCP+TLS handshake per call.
+
+    Connection errors, timeouts and RETRY_STATUSES responses are retried per
+    endpoint RetryPolicy with jittered exponential backoff, honouring
+    Retry-After, while the shared retry budget lasts. Requests that are not
+    ``idempotent`` (POST by default) are only retried when the server cannot
+    have processed them; callers recover the other cases themselves.
+    """
+
+    def __init__(
+        self,
+        apispec: ApiSpec,
+        pool_size: int = POOL_SIZE,
+        timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+        retry_policies: Optional[Dict[str, RetryPolicy]] = None,
+        retry_budget: int = RETRY_BUDGET,
+        recorder: Optional["RunRecorder"] = None,
+    ):
+        self.base_url = f"{apispec.scheme}://{apispec.basehost}"
+        self.recorder = recorder
+        self.timeouts = dict(TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.retry_policies = dict(RETRY_POLICIES)
+        if retry_policies:
+            self.retry_policies.update(retry_policies)
+        self.retry_budget = retry_budget
+        self.retry_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Token {apispec.apikey}"
+
+    def retry_policy(self, endpoint: str) -> RetryPolicy:
+        return self.retry_policies.get(endpoint, self.retry_policies["default"])
+
+    def backoff(self, endpoint: str, attempt: int) -> float:
+        """Jittered delay before retry number ``attempt`` (1-based)"""
+        policy = self.retry_policy(endpoint)
+        delay = min(policy.backoff * 2 ** (attempt - 1), policy.max_backoff)
+        return delay * random.uniform(1 - policy.jitter, 1 + policy.jitter)
+
+    def take_retry(self) -> bool:
+        """Spend one retry from the budget, False once it is exhausted"""
+        with self.retry_lock:
+            if self.retry_budget <= 0:
+                return False
+            self.retry_budget -= 1
+            return True
+
+    def _record(self, method, endpoint, path, start, response=None, error=None):
+        if self.recorder is not None:
+            self.recorder.record_http(method, endpoint, path, start, response, error)
+
+    def _send(self, method: str, path: str, **kwargs):
+        return self.session.request(method, f"{self.base_url}{path}", **kwargs)
+
+    def request(
+        self,
+        method: str,
+        endpoint: str,
+        path: str,
+        idempotent: Optional[bool] = None,
+        attempts: Optional[int] = None,
+        **kwargs,
+    ):
+        """Send a request, retrying it up to ``attempts`` times in total
+
+        ``attempts`` defaults to the endpoint RetryPolicy.
+        """
+        kwargs.setdefault(
+            "timeout", self.timeouts.get(endpoint, self.timeouts["default"])
+        )
+        if idempotent is None:
+            idempotent = method in ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+        attempts = attempts or self.retry_policy(endpoint).attempts
+
+        for attempt in range(1, attempts + 1):
+            start = self.recorder.clock() if self.recorder is not None else 0
+            try:
+                response = self._send(method, path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                self._record(method, endpoint, path, start, error=error)
+                if (
+                    attempt == attempts
+                    or not (idempotent or _request_not_sent(error))
+                    or not self.take_retry()
+                ):
+                    raise
+                reason, delay = error, self.backoff(endpoint, attempt)
+            else:
+                self._record(method, endpoint, path, start, response)
+                retry_statuses = (
+                    RETRY_STATUSES if idempotent else RETRY_UNPROCESSED_STATUSES
+                )
+                if (
+                    response.status_code not in retry_statuses
+                    or attempt == attempts
+                    or not self.take_retry()
+                ):
+                    return response
+                reason = response.status_code
+                delay = max(self.backoff(endpoint, attempt), _retry_after(response))
+
+            log.info(
+                "Retrying %s %s in %.1f s (attempt %d/%d): %s",
+                method,
+                path,
+                delay,
+                attempt + 1,
+                attempts,
+                reason,
+            )
+            time.sleep(delay)
+        return response
+
+    def get(self, endpoint: str, path: str, **kwargs):
+        return self.request("GET", endpoint, path, **kwargs)
+
+    def post(self, endpoint: str, path: str, **kwargs):
+        return self.request("POST", endpoint, path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _paginate(
+    client: RescaleClient,
+    endpoint: str,
+    path: str,
+    params: Optional[dict] = None,
+    prefetch: bool = False,
+) -> Iterator[dict]:
+    """Lazily yield the results of a listing endpoint page by page
+
+    Follows the ``next`` links of paginated responses; endpoints returning a
+    plain list are yielded as is. With ``prefetch`` the next page is requested
+    in the background while the current one is consumed. Closing the
+    generator early, e.g. once a match is found, stops fetching.
+    """
+
+    def fetch(page_path, page_params):
+        response = client.get(endpoint, page_path, params=page_params)
+        response.raise_for_status()
+        return response.json()
+
+    def next_page(page):
+        if isinstance(page, list) or not page.get("next"):
+            return None
+        url = urlparse(page["next"])
+        return f"{url.path}?{url.query}" if url.query else url.path
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = fetch(path, params)
+        while page is not None:
+            next_path = next_page(page)
+            upcoming = None
+            if next_path and prefetch:
+                upcoming = executor.submit(fetch, next_path, None)
+            try:
+                yield from page if isinstance(page, list) else page["results"]
+            except GeneratorExit:
+                if upcoming is not None:
+                    upcoming.cancel()
+                raise
+            if upcoming is not None:
+                page = upcoming.result()
+            elif next_path:
+                page = fetch(next_path, None)
+            else:
+                page = None
+
+
+# Job phases as inferred from (job status, cluster status) pairs
+PHASE_QUEUED = "queued"
+PHASE_STARTING = "starting"
+PHASE_RUNNING = "running"
+PHASE_STAGING = "staging"
+PHASE_COMPLETED = "completed"
+
+
+def _job_phase(job_status: str, cluster_status: Optional[str]) -> str:
+    if job_status == "Completed":
+        return PHASE_COMPLETED
+    if job_status == "Stopping" or cluster_status == "Stopping":
+        return PHASE_STAGING
+    if job_status == "Executing":
+        return PHASE_RUNNING
+    if cluster_status in ("Starting", "Started"):
+        return PHASE_STARTING
+    return PHASE_QUEUED
+
+
+JOB_PHASE_NAMES = {
+    PHASE_QUEUED: "queue",
+    PHASE_STARTING: "cluster_start",
+    PHASE_RUNNING: "build_run",
+    PHASE_STAGING: "stage_out",
+}
+
+
+def _job_phase_durations(timeline: list) -> Dict[str, float]:
+    """Seconds spent per job-side phase according to a status timeline"""
+    phases = dict.fromkeys(JOB_PHASE_NAMES.values(), 0.0)
+    for (elapsed, job_status, cluster_status), following in zip(
+        timeline, timeline[1:]
+    ):
+        phase = JOB_PHASE_NAMES.get(_job_phase(job_status, cluster_status))
+        if phase is not None:
+            phases[phase] += following[0] - elapsed
+    return {k: round(v, 3) for k, v in phases.items()}
+
+
+class RunRecorder:
+    """Timing spans of build stages and HTTP calls of one run
+
+    Spans are recorded around each stage of every image build and around
+    every HTTP request (endpoint, status, bytes, latency). Job-side phases
+    (queue time, cluster start, build run, stage-out) are inferred from the
+    status transitions observed by the monitor, so they are only as precise
+    as the polling interval. The collected data is written as a JSON report
+    and optionally as a Prometheus textfile.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.stages: List[dict] = []
+        self.http: List[dict] = []
+        self.jobs: Dict[str, dict] = {}
+
+    @contextlib.contextmanager
+    def span(self, stage: str, image: Optional[str] = None):
+        """Record the duration of the enclosed build stage"""
+        start = self.clock()
+        error = None
+        try:
+            yield
+        except BaseException as exc:
+            error = repr(exc)
+            raise
+        finally:
+            with self.lock:
+                self.stages.append(
+                    {
+                        "stage": stage,
+                        "image": image,
+                        "start": round(start - self.started, 6),
+                        "duration": round(self.clock() - start, 6),
+                        "error": error,
+                    }
+                )
+
+    def record_http(
+        self,
+        method: str,
+        endpoint: str,
+        path: str,
+        start: float,
+        response=None,
+        error: Optional[Exception] = None,
+    ):
+        latency = self.clock() - start
+        sent = received = 0
+        if response is not None:
+            body = response.request.body if response.request is not None else None
+            sent = len(body) if body is not None and hasattr(body, "__len__") else 0
+            received = len(response.content or b"")
+        with self.lock:
+            self.http.append(
+                {
+                    "method": method,
+                    "endpoint": endpoint,
+                    "path": path,
+                    "status": response.status_code if response is not None else None,
+                    "error": repr(error) if error is not None else None,
+                    "bytes_sent": sent,
+                    "bytes_received": received,
+                    "start": round(start - self.started, 6),
+                    "latency": round(latency, 6),
+                }
+            )
+
+    def record_job(self, job_id: str, timeline: list, image: Optional[str] = None):
+        with self.lock:
+            self.jobs[job_id] = {
+                "image": image,
+                "phases": _job_phase_durations(timeline),
+                "timeline": timeline,
+            }
+
+    def report(self) -> dict:
+        with self.lock:
+            stage_totals: Dict[str, float] = collections.defaultdict(float)
+            for span in self.stages:
+                stage_totals[span["stage"]] += span["duration"]
+            endpoints: Dict[str, dict] = {}
+            for call in self.http:
+                summary = endpoints.setdefault(
+                    call["endpoint"],
+                    {
+                        "requests": 0,
+                        "errors": 0,
+                        "statuses": collections.Counter(),
+                        "bytes_sent": 0,
+                        "bytes_received": 0,
+                        "latency_total": 0.0,
+                        "latency_max": 0.0,
+                    },
+                )
+                summary["requests"] += 1
+                summary["errors"] += call["error"] is not None
+                summary["statuses"][str(call["status"] or "error")] += 1
+                summary["bytes_sent"] += call["bytes_sent"]
+                summary["bytes_received"] += call["bytes_received"]
+                summary["latency_total"] += call["latency"]
+                summary["latency_max"] = max(summary["latency_max"], call["latency"])
+            return {
+                "started": self.started_at,
+                "wall_time": round(self.clock() - self.started, 6),
+                "stage_totals": {k: round(v, 6) for k, v in stage_totals.items()},
+                "stages": list(self.stages),
+                "http_summary": {
+                    endpoint: dict(
+                        summary,
+                        statuses=dict(summary["statuses"]),
+                        latency_total=round(summary["latency_total"], 6),
+                    )
+                    for endpoint, summary in endpoints.items()
+                },
+                "http": list(self.http),
+                "jobs": dict(self.jobs),
+            }
+
+    def write_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def write_prometheus(self, path: str):
+        """Write the report as a node_exporter textfile collector file"""
+        report = self.report()
+        lines = [
+            "# TYPE apptainer_build_run_seconds gauge",
+            f"apptainer_build_run_seconds {report['wall_time']}",
+            "# TYPE apptainer_build_stage_seconds gauge",
+        ]
+        stage_seconds: Dict[Tuple[str, str], float] = collections.defaultdict(float)
+        for span in report["stages"]:
+            stage_seconds[span["stage"], span["image"] or ""] += span["duration"]
+        for (stage, image), seconds in sorted(stage_seconds.items()):
+            labels = _prometheus_labels(stage=stage, image=image)
+            lines.append(f"apptainer_build_stage_seconds{labels} {seconds}")
+
+        lines.append("# TYPE apptainer_build_http_requests_total counter")
+        for endpoint, summary in sorted(report["http_summary"].items()):
+            for status, count in sorted(summary["statuses"].items()):
+                labels = _prometheus_labels(endpoint=endpoint, status=status)
+                lines.append(f"apptainer_build_http_requests_total{labels} {count}")
+        lines.append("# TYPE apptainer_build_http_request_seconds summary")
+        for endpoint, summary in sorted(report["http_summary"].items()):
+            labels = _prometheus_labels(endpoint=endpoint)
+            lines.append(
+                f"apptainer_build_http_request_seconds_sum{labels} "
+                f"{summary['latency_total']}"
+            )
+            lines.append(
+                f"apptainer_build_http_request_seconds_count{labels} "
+                f"{summary['requests']}"
+            )
+        lines.append("# TYPE apptainer_build_http_bytes_total counter")
+        for endpoint, summary in sorted(report["http_summary"].items()):
+            for direction in ("sent", "received"):
+                labels = _prometheus_labels(endpoint=endpoint, direction=direction)
+                lines.append(
+                    f"apptainer_build_http_bytes_total{labels} "
+                    f"{summary['bytes_' + direction]}"
+                )
+
+        lines.append("# TYPE apptainer_build_job_phase_seconds gauge")
+        for job_id, job in sorted(report["jobs"].items()):
+            for phase, seconds in job["phases"].items():
+                labels = _prometheus_labels(
+                    job_id=job_id, image=job["image"] or "", phase=phase
+                )
+                lines.append(f"apptainer_build_job_phase_seconds{labels} {seconds}")
+
+        # Collectors may read the file at any time, so replace it atomically
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def write(self, report_path: Optional[str], prometheus_path: Optional[str]):
+        if report_path:
+            self.write_json(report_path)
+            log.info("Run report written to %s", report_path)
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+
+
+def _prometheus_labels(**labels) -> str:
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _span(client, stage: str, image: Optional[str] = None):
+    """Stage span on the client's recorder, if it has one"""
+    recorder = getattr(client, "recorder", None)
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.span(stage, image)
+
+
+class PollPolicy(abc.ABC):
+    """Decides how long to wait before the next job status poll"""
+
+    @abc.abstractmethod
+    def next_interval(
+        self, phase: str, unchanged_polls: int, phase_elapsed: float
+    ) -> float:
+        """Seconds to sleep given the current phase, the number of polls in a
+        row that saw no status change and the time spent in the phase"""
+
+
+class FixedPollPolicy(PollPolicy):
+    """Constant poll interval regardless of job phase"""
+
+    def __init__(self, interval: float = 30):
+        self.interval = interval
+
+    def next_interval(self, phase, unchanged_polls, phase_elapsed):
+        return self.interval
+
+
+class AdaptivePollPolicy(PollPolicy):
+    """Phase-aware exponential backoff with jitter
+
+    Each phase starts polling at its base interval which grows by ``factor``
+    for every poll that sees no status change, up to the phase maximum. While
+    running, polling tightens to the staging interval once ``expected_runtime``
+    is nearly reached, since completion is then imminent.
+    """
+
+    BASE_INTERVALS = {
+        PHASE_QUEUED: 30,
+        PHASE_STARTING: 15,
+        PHASE_RUNNING: 20,
+        PHASE_STAGING: 5,
+    }
+    MAX_INTERVALS = {
+        PHASE_QUEUED: 300,
+        PHASE_STARTING: 60,
+        PHASE_RUNNING: 60,
+        PHASE_STAGING: 10,
+    }
+
+    def __init__(
+        self,
+        base_intervals: Optional[Dict[str, float]] = None,
+        max_intervals: Optional[Dict[str, float]] = None,
+        factor: float = 1.5,
+        jitter: float = 0.2,
+        expected_runtime: Optional[float] = None,
+        rng: Optional[random.Random] = None,
+    ):
+        self.base_intervals = dict(self.BASE_INTERVALS)
+        if base_intervals:
+            self.base_intervals.update(base_intervals)
+        self.max_intervals = dict(self.MAX_INTERVALS)
+        if max_intervals:
+            self.max_intervals.update(max_intervals)
+        self.factor = factor
+        self.jitter = jitter
+        self.expected_runtime = expected_runtime
+        self.rng = rng or random.Random()
+
+    def next_interval(self, phase, unchanged_polls, phase_elapsed):
+        phase = phase if phase in self.base_intervals else PHASE_QUEUED
+        interval = min(
+            self.base_intervals[phase] * self.factor**unchanged_polls,
+            self.max_intervals[phase],
+        )
+
+        if (
+            phase == PHASE_RUNNING
+            and self.expected_runtime is not None
+            and phase_elapsed >= 0.9 * self.expected_runtime
+        ):
+            interval = min(interval, self.base_intervals[PHASE_STAGING])
+
+        return interval * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class CappedPollPolicy(PollPolicy):
+    """Limits the interval of another policy while the job is in ``phases``"""
+
+    def __init__(self, policy: PollPolicy, max_interval: float, phases):
+        self.policy = policy
+        self.max_interval = max_interval
+        self.phases = set(phases)
+
+    def next_interval(self, phase, unchanged_polls, phase_elapsed):
+        interval = self.policy.next_interval(phase, unchanged_polls, phase_elapsed)
+        if phase in self.phases:
+            return min(interval, self.max_interval)
+        return interval
+
+
+class _JsonStore:
+    """Thread-safe JSON document persisted to a file in the cache directory"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        try:
+            with open(path, encoding="utf-8") as file:
+                self.data = json.load(file)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.data, file, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def _sha256(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_available(file_id: str, client: RescaleClient) -> bool:
+    response = client.get("files", f"/api/v2/files/{file_id}/")
+    if response.status_code == 404 or (
+        response.ok and response.json().get("isDeleted")
+    ):
+        return False
+    response.raise_for_status()
+    return True
+
+
+class UploadCache:
+    """Content-addressed index of uploaded files: (SHA-256, name) -> file id
+
+    The file name is part of the key because jobs refer to their inputs by
+    name. Cached ids are checked against the API before reuse, and entries
+    are evicted once older than ``max_age_days`` or, least recently used
+    first, when more than ``max_entries`` are stored.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_DIR, "uploads.json"),
+        max_entries: int = UPLOAD_CACHE_MAX_ENTRIES,
+        max_age_days: float = UPLOAD_CACHE_MAX_AGE_DAYS,
+    ):
+        self.store = _JsonStore(path)
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 3600
+
+    @staticmethod
+    def key(filepath: str) -> str:
+        return f"{_sha256(filepath)}:{os.path.basename(filepath)}"
+
+    def lookup(self, key: str, client: RescaleClient) -> Optional[str]:
+        with self.store.lock:
+            entry = self.store.data.get(key)
+        if entry is None:
+            return None
+
+        if not _file_available(entry["id"], client):
+            log.info("Cached file id = %s is no longer available", entry["id"])
+            with self.store.lock:
+                self.store.data.pop(key, None)
+                self.store.save()
+            return None
+
+        with self.store.lock:
+            entry["used"] = time.time()
+            self.store.save()
+        return entry["id"]
+
+    def add(self, key: str, file_id: str):
+        now = time.time()
+        with self.store.lock:
+            self.store.data[key] = {"id": file_id, "uploaded": now, "used": now}
+            self._evict(now)
+            self.store.save()
+
+    def _evict(self, now: float):
+        entries = self.store.data
+        expired = [k for k, e in entries.items() if now - e["uploaded"] > self.max_age]
+        for key in expired:
+            del entries[key]
+        for key in sorted(entries, key=lambda k: entries[k]["used"])[
+            : max(0, len(entries) - self.max_entries)
+        ]:
+            del entries[key]
+
+
+def _pinned_revision(buildscript: str) -> Optional[str]:
+    """Full commit sha the build script checks out, if it pins one
+
+    Like build_script.sh, only a literal 40 hex digit sha counts. Branches,
+    tags and shell expansions may point elsewhere by the next build.
+    """
+    for pattern in (
+        r"^\s*\w*(?:REVISION|COMMIT|REF)=([\"']?)([0-9a-f]{40})\1\s*(?:#.*)?$",
+        r"^[^#\n]*git\s+(?:checkout|fetch)\s+[^#\n]*(?<![\w$])([0-9a-f]{40})\b",
+    ):
+        match = re.search(pattern, buildscript, re.MULTILINE)
+        if match:
+            return match.groups()[-1]
+    return None
+
+
+def _source_pinned(jobspec: JobSpec) -> bool:
+    """True if the build sources are fixed, by the build script pinning a
+    revision or by an uploaded SOURCE_ARCHIVE"""
+    if any(os.path.basename(path) == SOURCE_ARCHIVE for path in jobspec.input_paths):
+        return True
+    with open(jobspec.buildscript_path, encoding="utf-8", errors="replace") as file:
+        return _pinned_revision(file.read()) is not None
+
+
+def _fetches_unpinned_source(jobspec: JobSpec) -> bool:
+    """True if the build script fetches sources with git without pinning them
+
+    Such a build would either fail on the cluster, as build_script.sh
+    refuses unpinned sources, or build whatever upstream holds at the time.
+    """
+    if _source_pinned(jobspec):
+        return False
+    with open(jobspec.buildscript_path, encoding="utf-8", errors="replace") as file:
+        buildscript = file.read()
+    return bool(
+        re.search(r"^[^#\n]*\bgit\s+(?:clone|fetch)\b", buildscript, re.MULTILINE)
+    )
+
+
+def _base_image(deffile: bytes) -> str:
+    """Base image reference of the def file ``From:`` line"""
+    match = re.search(rb"^\s*From:\s*(\S+)", deffile, re.MULTILINE | re.IGNORECASE)
+    return match.group(1).decode() if match else ""
+
+
+def _build_fingerprint(jobspec: JobSpec) -> str:
+    """Hash of everything that determines the produced image
+
+    Covers the def file, the build script, any extra input files, the base
+    image reference from the def file ``From:`` line, the source revision
+    pinned by the script and the SIF compression.
+    """
+    with open(jobspec.deffile_path, "rb") as file:
+        deffile = file.read()
+    with open(jobspec.buildscript_path, "rb") as file:
+        buildscript = file.read()
+
+    base_image = _base_image(deffile).encode()
+    inputs = "".join(
+        f"{os.path.basename(path)}:{_sha256(path)}\n" for path in jobspec.input_paths
+    ).encode()
+    revision = _pinned_revision(buildscript.decode(errors="replace"))
+    parts = [deffile, buildscript, inputs, base_image, (revision or "").encode()]
+    # Only part of the fingerprint when set, so earlier builds stay reusable
+    if jobspec.compression:
+        parts.append(jobspec.compression.encode())
+
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """Index of build fingerprints -> id of the job that produced the image
+
+    The fingerprint is also written into the build job description, so a
+    previous build can be found through the API when the local index does
+    not know it, e.g. on a fresh CI runner.
+    """
+
+    def __init__(self, path: str = os.path.join(CACHE_DIR, "builds.json")):
+        self.store = _JsonStore(path)
+
+    def lookup(self, fingerprint: str, jobname: str, client: RescaleClient):
+        """Id of a job that built an image with ``fingerprint`` and whose SIF
+        is still available, or None"""
+        with self.store.lock:
+            entry = self.store.data.get(fingerprint)
+        if entry is not None:
+            if _has_sif_output(entry["job_id"], client):
+                return entry["job_id"]
+            with self.store.lock:
+                self.store.data.pop(fingerprint, None)
+                self.store.save()
+
+        for job in _paginate(
+            client,
+            "jobs",
+            "/api/v2/jobs/",
+            {"search": jobname, "page_size": PAGE_SIZE},
+            prefetch=True,
+        ):
+            if fingerprint not in (job.get("description") or ""):
+                continue
+            job_status, _ = _fetch_statuses(job["id"], client)
+            if job_status == "Completed" and _has_sif_output(job["id"], client):
+                self.add(fingerprint, job["id"])
+                return job["id"]
+        return None
+
+    def add(self, fingerprint: str, job_id: str):
+        with self.store.lock:
+            self.store.data[fingerprint] = {"job_id": job_id, "built": time.time()}
+            self.store.save()
+
+
+def _layer_cache_key(jobspec: JobSpec) -> Optional[str]:
+    """Base image of the build, a digest when the def file pins one"""
+    with open(jobspec.deffile_path, "rb") as file:
+        return _base_image(file.read()) or None
+
+
+def _wheelhouse_cache_key(jobspec: JobSpec) -> Optional[str]:
+    """(Python version, torch/CUDA tag, requirements hash) of the pip installs
+
+    The base image stands in for the Python version it ships. The wheelhouse
+    is only used through ``--find-links``, so a key shared by builds with
+    different requirements merely offers pip wheels it will not pick.
+    """
+    with open(jobspec.deffile_path, "rb") as file:
+        deffile = file.read().decode(errors="replace")
+    pip_lines = re.findall(r"^\s*pip3?\s+install\b.*$", deffile, re.MULTILINE)
+    if not pip_lines:
+        return None
+    match = re.search(r"torch-([\w.]+\+\w+)", deffile)
+    torch_tag = match.group(1) if match else ""
+    requirements = hashlib.sha256("\n".join(pip_lines).encode()).hexdigest()[:16]
+    return f"{_base_image(deffile.encode())}|{torch_tag}|{requirements}"
+
+
+class ArtifactCache:
+    """Build job outputs reused as inputs of later builds with the same key
+
+    A build job leaving ``archive`` among its outputs has it registered under
+    the key ``keyfunc`` derives from the build; later builds with that key
+    get the file attached as an input, for the build script to restore.
+    Files the API no longer has are dropped on lookup.
+    """
+
+    def __init__(self, archive: str, keyfunc, path: Optional[str] = None):
+        self.archive = archive
+        self.keyfunc = keyfunc
+        self.store = _JsonStore(path or os.path.join(CACHE_DIR, f"{archive}.json"))
+
+    def key(self, jobspec: JobSpec) -> Optional[str]:
+        return self.keyfunc(jobspec)
+
+    def lookup(self, key: Optional[str], client: RescaleClient) -> Optional[str]:
+        with self.store.lock:
+            entry = self.store.data.get(key) if key else None
+        if entry is None:
+            return None
+        if not _file_available(entry["id"], client):
+            log.info(
+                "Cached %s id = %s is no longer available", self.archive, entry["id"]
+            )
+            with self.store.lock:
+                self.store.data.pop(key, None)
+                self.store.save()
+            return None
+        log.info("Attaching cached %s for %s", self.archive, key)
+        return entry["id"]
+
+    def harvest(
+        self, key: Optional[str], job_id: str, client: RescaleClient
+    ) -> Optional[str]:
+        """Register the ``archive`` output of ``job_id`` under ``key``"""
+        if not key:
+            return None
+        outputs = [
+            f
+            for f in _find_job_files(job_id, client, self.archive)
+            if f["name"] == self.archive
+        ]
+        if len(outputs) != 1:
+            return None
+        with self.store.lock:
+            self.store.data[key] = {
+                "id": outputs[0]["id"],
+                "job_id": job_id,
+                "added": time.time(),
+            }
+            self.store.save()
+        log.info("Saved %s of job %s for %s", self.archive, job_id, key)
+        return outputs[0]["id"]
+
+
+class BuildHistory:
+    """Measured job-side phase durations and usage of completed builds
+
+    Only the latest ``max_runs`` builds of each image are kept. The build
+    run phase covers the whole build script, as observed by status polling.
+    Builds whose running phase was never observed, e.g. when monitoring
+    started after completion, are not recorded.
+    The usage (peak memory, CPU utilisation) is the one reported by the
+    build script, when it reports any.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_DIR, "history.json"),
+        max_runs: int = HISTORY_MAX_RUNS,
+    ):
+        self.store = _JsonStore(path)
+        self.max_runs = max_runs
+
+    def add(
+        self,
+        jobspec: JobSpec,
+        job_id: str,
+        timeline: list,
+        usage: Optional[dict] = None,
+    ):
+        phases = _job_phase_durations(timeline)
+        if phases["build_run"] <= 0:
+            log.info("Build run of job %s not observed, not recording it", job_id)
+            return
+        run = {
+            "job_id": job_id,
+            "coretype": jobspec.coretype,
+            "core_count": jobspec.core_count,
+            "walltime": jobspec.walltime,
+            "finished": time.time(),
+            "phases": phases,
+            "usage": usage,
+        }
+        with self.store.lock:
+            runs = self.store.data.setdefault(jobspec.name, [])
+            runs.append(run)
+            del runs[: max(0, len(runs) - self.max_runs)]
+            self.store.save()
+
+    def runs(self, image: str) -> List[dict]:
+        with self.store.lock:
+            return list(self.store.data.get(image, []))
+
+    def images(self) -> List[str]:
+        with self.store.lock:
+            return sorted(self.store.data)
+
+
+def _print_speedup(history: BuildHistory, image: Optional[str] = None):
+    """Measured build speedup per core count of every image
+
+    Speedup and efficiency are relative to the fewest cores measured on the
+    same coretype. Core hours cover the cluster from start to stage-out.
+    """
+    for name in [image] if image else history.images():
+        by_hardware = collections.defaultdict(list)
+        for run in history.runs(name):
+            if run["phases"]["build_run"] > 0:
+                by_hardware[run["coretype"], run["core_count"]].append(run["phases"])
+        if not by_hardware:
+            continue
+
+        print(name)
+        print(
+            f"{'coretype':<12}{'cores':>6}{'runs':>6}{'build min':>11}"
+            f"{'speedup':>9}{'efficiency':>12}{'core h':>9}"
+        )
+        baselines = {}
+        for (coretype, cores), phases in sorted(by_hardware.items()):
+            build = statistics.median(p["build_run"] for p in phases)
+            billed = statistics.median(
+                p["cluster_start"] + p["build_run"] + p["stage_out"] for p in phases
+            )
+            base_cores, base_build = baselines.setdefault(coretype, (cores, build))
+            speedup = base_build / build if build else 0.0
+            efficiency = speedup * base_cores / cores
+            print(
+                f"{coretype:<12}{cores:>6}{len(phases):>6}{build / 60:>11.1f}"
+                f"{speedup:>9.2f}{efficiency:>12.0%}{cores * billed / 3600:>9.2f}"
+            )
+        print()
+
+
+def _coretypes(client: RescaleClient) -> Dict[str, dict]:
+    return {
+        coretype["code"]: coretype
+        for coretype in _paginate(
+            client, "coretypes", "/api/v2/coretypes/", {"page_size": PAGE_SIZE}
+        )
+    }
+
+
+def _size_hardware(
+    jobspec: JobSpec,
+    history: BuildHistory,
+    coretypes: Dict[str, dict],
+    margin: float = SIZING_MARGIN,
+) -> JobSpec:
+    """Coretype, cores and walltime for the next build of an image
+
+    Among the hardware measured for the image, the one with the fewest core
+    hours whose median build run is within SIZING_TIME_TOLERANCE of the
+    fastest is picked. When only one core count of that coretype was
+    measured, the cores shrink to the busy cores reported by the build plus
+    ``margin``. They then grow until the peak memory plus ``margin`` fits the
+    coretype memory per core. The walltime covers the longest measured job
+    plus ``margin``, stretched when fewer cores are picked. Images without
+    history keep their hardware.
+    """
+    by_hardware = collections.defaultdict(list)
+    for run in history.runs(jobspec.name):
+        if run["phases"]["build_run"] > 0:
+            by_hardware[run["coretype"], run["core_count"]].append(run)
+    if not by_hardware:
+        log.info("No build history of %s, keeping its hardware", jobspec.name)
+        return jobspec
+
+    build_times = {
+        hardware: statistics.median(run["phases"]["build_run"] for run in runs)
+        for hardware, runs in by_hardware.items()
+    }
+    fastest = min(build_times.values())
+    coretype, measured_cores = min(
+        (
+            hardware
+            for hardware, build_time in build_times.items()
+            if build_time <= fastest * (1 + SIZING_TIME_TOLERANCE)
+        ),
+        key=lambda hardware: hardware[1] * build_times[hardware],
+    )
+    measured = by_hardware[coretype, measured_cores]
+    usages = [run["usage"] for run in measured if run.get("usage")]
+    info = coretypes.get(coretype, {})
+    options = sorted(info.get("cores") or DEFAULT_CORE_OPTIONS)
+
+    cores = measured_cores
+    if usages and sum(1 for hardware in by_hardware if hardware[0] == coretype) == 1:
+        busy = max(
+            usage["cpu_utilization"] * usage.get("cores", measured_cores)
+            for usage in usages
+        )
+        cores = min(
+            measured_cores,
+            next((c for c in options if c >= busy * (1 + margin)), options[-1]),
+        )
+    if usages and info.get("memory"):
+        peak = max(usage["peak_memory_mb"] for usage in usages) * (1 + margin)
+        cores = next(
+            (c for c in options if c >= cores and c * info["memory"] >= peak),
+            options[-1],
+        )
+
+    seconds = max(
+        run["phases"]["cluster_start"]
+        + run["phases"]["build_run"]
+        + run["phases"]["stage_out"]
+        for run in measured
+    )
+    seconds *= max(1.0, measured_cores / cores) * (1 + margin)
+    walltime = max(1, math.ceil(seconds / 3600))
+
+    log.info(
+        "Sized %s from %d measured builds: %s, %d cores, %d h walltime",
+        jobspec.name,
+        sum(len(runs) for runs in by_hardware.values()),
+        coretype,
+        cores,
+        walltime,
+    )
+    return jobspec._replace(coretype=coretype, core_count=cores, walltime=walltime)
+
+
+def _auto_size(
+    jobspecs: List[JobSpec],
+    apispec: ApiSpec,
+    history: BuildHistory,
+    margin: float = SIZING_MARGIN,
+) -> List[JobSpec]:
+    """Size the hardware of every image from its build history"""
+    with RescaleClient(apispec) as client:
+        try:
+            coretypes = _coretypes(client)
+        except requests.RequestException as error:
+            log.warning("Coretypes unavailable, sizing without memory: %r", error)
+            coretypes = {}
+    return [_size_hardware(jobspec, history, coretypes, margin) for jobspec in jobspecs]
+
+
+JOURNAL_STAGES = ("uploaded", "created", "submitted", "completed", "linked", "done")
+
+
+def _stage_reached(record: dict, stage: str) -> bool:
+    reached = record.get("stage")
+    return reached is not None and (
+        JOURNAL_STAGES.index(reached) >= JOURNAL_STAGES.index(stage)
+    )
+
+
+class RunJournal:
+    """Per-image checkpoints of the build stages reached so far
+
+    Every stage of a build records its results (uploaded file ids, job id,
+    stage reached) in a JSON file per image name. With ``resume`` a build
+    picks up after the last completed stage, provided its fingerprint still
+    matches, instead of uploading and submitting again. The record also
+    keeps what ``wait`` and ``finalize`` need to do the bookkeeping of a
+    detached build: its job spec, artifact cache keys and status timeline.
+    """
+
+    def __init__(
+        self, directory: str = os.path.join(CACHE_DIR, "journal"), resume: bool = False
+    ):
+        self.directory = directory
+        self.resume = resume
+
+    def _store(self, name: str) -> _JsonStore:
+        digest = hashlib.sha256(name.encode()).hexdigest()[:16]
+        return _JsonStore(os.path.join(self.directory, f"{digest}.json"))
+
+    def start(self, name: str, fingerprint: str) -> dict:
+        """Journal record to build ``name`` with, resumed if possible"""
+        record = self._store(name).data
+        if self.resume and record.get("fingerprint") == fingerprint:
+            if record.get("stage"):
+                log.info(
+                    "Resuming %s after stage '%s' (job %s)",
+                    name,
+                    record["stage"],
+                    record.get("job_id"),
+                )
+            return record
+        if self.resume and record:
+            log.info("Inputs of %s changed since the journaled run", name)
+        return {"name": name, "fingerprint": fingerprint, "stage": None}
+
+    def save(self, record: dict):
+        store = self._store(record["name"])
+        store.data = record
+        store.save()
+
+    def find(self, job_id: str) -> Optional[dict]:
+        """Journal record of the build run by ``job_id``, if any"""
+        if not os.path.isdir(self.directory):
+            return None
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.endswith(".json"):
+                record = _JsonStore(os.path.join(self.directory, filename)).data
+                if record.get("job_id") == job_id:
+                    return record
+        return None
+
+
+def _checkpoint(journal: Optional[RunJournal], record: dict, stage: str, **fields):
+    record.update(fields, stage=stage, updated=time.time())
+    if journal is not None:
+        journal.save(record)
 
 
 def _init_logging():
@@ -53,45 +1291,133 @@ def _init_logging():
     log.addHandler(console_handler)
 
 
-def _upload_file(filepath: str, apikey: str, basehost: str):
-    with open(filepath, "rb") as file:
-        response = requests.post(
-            f"https://{basehost}/api/v2/files/contents/",
-            headers={
-                "Authorization": f"Token {apikey}"
-            },
-            data={},
-            files=[
-                (
-                    "file",
-                    (
-                        os.path.basename(filepath),
-                        file,
-                        "application/octet-stream",
-                    ),
-                )
-            ],
-        )
-        response.raise_for_status()
+class _MultipartFileStream:
+    """multipart/form-data request body streamed from a memory-mapped file
+
+    Iterating yields the multipart preamble, the file content in fixed-size
+    chunks and the closing boundary, so memory use stays flat regardless of
+    the file size. Throughput is logged while the body is consumed.
+    """
+
+    def __init__(self, filepath: str, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(filepath)
+        self.boundary = uuid.uuid4().hex
+        self.preamble = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; '
+            f'filename="{os.path.basename(filepath)}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        self.epilogue = f"\r\n--{self.boundary}--\r\n".encode()
+        self.sent = 0
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self.preamble) + self.size + len(self.epilogue)
+
+    def __iter__(self):
+        self.sent = 0
+        started = last_report = time.monotonic()
+        yield self.preamble
+        if self.size:
+            with open(self.filepath, "rb") as file, mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped:
+                for offset in range(0, self.size, self.chunk_size):
+                    chunk = mapped[offset : offset + self.chunk_size]
+                    yield chunk
+                    self.sent = offset + len(chunk)
+                    now = time.monotonic()
+                    if now - last_report >= UPLOAD_PROGRESS_INTERVAL:
+                        last_report = now
+                        log.info(
+                            "Uploading %s: %.0f%% (%.1f MB/s)",
+                            os.path.basename(self.filepath),
+                            100 * self.sent / self.size,
+                            self.sent / (now - started) / 1e6,
+                        )
+        yield self.epilogue
+
+
+def _upload_file(
+    filepath: str, client: RescaleClient, cache: Optional[UploadCache] = None
+):
+    if cache is not None:
+        key = cache.key(filepath)
+        file_id = cache.lookup(key, client)
+        if file_id is not None:
+            log.info("Reusing unchanged %s with id = %s", filepath, file_id)
+            return file_id
+
+    # The files/contents endpoint has no partial upload support, so when the
+    # client retries a dropped connection the body is streamed from the start.
+    # A duplicate upload only leaves an unused file behind.
+    body = _MultipartFileStream(filepath)
+    started = time.monotonic()
+    response = client.post(
+        "upload",
+        "/api/v2/files/contents/",
+        idempotent=True,
+        data=body,
+        headers={"Content-Type": body.content_type},
+    )
+    response.raise_for_status()
     file_id = response.json()["id"]
+    if cache is not None:
+        cache.add(key, file_id)
 
-    log.info("Successfully uploaded file with id = %s", file_id)
+    elapsed = max(time.monotonic() - started, 1e-6)
+    log.info(
+        "Successfully uploaded file with id = %s (%d bytes, %.1f MB/s)",
+        file_id,
+        body.size,
+        body.size / elapsed / 1e6,
+    )
     return file_id
 
 
-def _create_build_job(file_ids: List[str], jobspec: JobSpec, apispec: ApiSpec):
+def _build_command(jobspec: JobSpec) -> str:
+    """Job command running the build script with the build settings
+
+    The build script passes the core count on to the compilers and the
+    compression on to mksquashfs.
+    """
+    settings = f"BUILD_CORES={jobspec.core_count} "
+    if jobspec.compression:
+        settings += f"SIF_COMPRESSION={jobspec.compression} "
+    return f"{settings}sh {os.path.basename(jobspec.buildscript_path)}"
+
+
+def _create_build_job(
+    file_ids: List[str],
+    jobspec: JobSpec,
+    client: RescaleClient,
+    fingerprint: Optional[str] = None,
+):
     log.info("Creating a job")
 
+    # The request token lets a retry find a job created by an attempt whose
+    # response was lost
+    request_token = uuid.uuid4().hex
+    description = "Apptainer Image Build Job"
+    if fingerprint:
+        description += f"\nFingerprint: {fingerprint}"
+    description += f"\nRequest: {request_token}"
     jobspec_json = {
         "name": jobspec.name,
-        "description": "Apptainer Image Build Job",
+        "description": description,
         "jobanalyses": [
             {
                 "analysis": {
                     "code": jobspec.analysis_code,
                     "version": jobspec.analysis_version,
                 },
-                "command": f"sh {os.path.basename(jobspec.buildscript_path)}",
+                "command": _build_command(jobspec),
                 "hardware": {
                     "coresPerSlot": jobspec.core_count,
                     "slots": 1,
@@ -103,204 +1429,1749 @@ def _create_build_job(file_ids: List[str], jobspec: JobSpec, apispec: ApiSpec):
             }
         ],
     }
-    response = requests.post(
-        f"https://{apispec.basehost}/api/v2/jobs/",
-        data=json.dumps(jobspec_json, indent=2),
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Token {apispec.apikey}",
-        },
+    job_id = _post_once(
+        client,
+        "/api/v2/jobs/",
+        jobspec_json,
+        lambda: _find_job_by_request_token(jobspec.name, request_token, client),
     )
-    response.raise_for_status()
-    job_id = response.json()["id"]
 
     log.info("Successfully created a job with id = %s", job_id)
     return job_id
 
 
-def _submit_build_job(job_id: str, apispec: ApiSpec):
-    log.info("Submitting job id = %s", job_id)
+def _post_once(client: RescaleClient, path: str, payload, recover):
+    """POST a non-idempotent jobs request, retrying only when safe
 
-    response = requests.post(
-        f"https://{apispec.basehost}/api/v2/jobs/{job_id}/submit/",
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Token {apispec.apikey}",
-        },
-    )
+    After a connection error, timeout, 429 or 5xx the request may or may not
+    have been processed, so ``recover()`` is asked first; its non-None result
+    is returned instead of posting again. Otherwise returns the ``id`` from
+    the response, or None when the response has no body. Each POST is sent
+    once by the client, so only this loop decides when to post again.
+    """
+    attempts = client.retry_policy("jobs").attempts
+    for attempt in range(1, attempts + 1):
+        try:
+            response = client.post("jobs", path, attempts=1, json=payload)
+            response.raise_for_status()
+            return response.json().get("id") if response.content else None
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.HTTPError,
+        ) as error:
+            if isinstance(error, requests.HTTPError) and (
+                error.response is None
+                or error.response.status_code < 500
+                and error.response.status_code not in RETRY_UNPROCESSED_STATUSES
+            ):
+                raise
+            recovered = recover()
+            if recovered is not None:
+                log.info("%s went through despite %s", path, error)
+                return recovered
+            if attempt == attempts or not client.take_retry():
+                raise
+            delay = client.backoff("jobs", attempt)
+            if isinstance(error, requests.HTTPError):
+                delay = max(delay, _retry_after(error.response))
+            log.info("Retrying POST %s in %.1f s: %s", path, delay, error)
+            time.sleep(delay)
+    return None
+
+
+def _find_job_by_request_token(
+    name: str, request_token: str, client: RescaleClient
+) -> Optional[str]:
+    for job in _paginate(
+        client, "jobs", "/api/v2/jobs/", {"search": name, "page_size": PAGE_SIZE}
+    ):
+        if request_token in (job.get("description") or ""):
+            return job["id"]
+    return None
+
+
+def _job_was_submitted(job_id: str, client: RescaleClient) -> Optional[bool]:
+    """True if the job has moved past Pending, None otherwise
+
+    A submitted job reports only Pending until it is queued, so None does
+    not mean the job was not submitted. Submitting it again tells, as the API
+    refuses to submit a job twice (see _already_submitted).
+    """
+    response = client.get("status", f"/api/v2/jobs/{job_id}/statuses/")
     response.raise_for_status()
+    statuses = {status["status"] for status in response.json()["results"]}
+    return True if statuses - {"Pending"} else None
 
 
-def _monitor_job(job_id: str, apispec: ApiSpec, status_poll_sleep: int = 30):
-    while True:
-        response = requests.get(
-            f"https://{apispec.basehost}/api/v2/jobs/{job_id}/statuses/",
-            headers={"Authorization": f"Token {apispec.apikey}"},
+def _already_submitted(error: requests.HTTPError) -> bool:
+    """True if the API refused a submit because the job was submitted before"""
+    return (
+        error.response is not None
+        and error.response.status_code == 400
+        and "already submitted" in error.response.text.lower()
+    )
+
+
+def _submit_build_job(job_id: str, client: RescaleClient):
+    """Submit a job, succeeding as well when it was submitted before
+
+    An earlier submit may have gone through with its response lost, either
+    within the retries here or in an interrupted run being resumed.
+    """
+    log.info("Submitting job id = %s", job_id)
+
+    try:
+        _post_once(
+            client,
+            f"/api/v2/jobs/{job_id}/submit/",
+            None,
+            lambda: _job_was_submitted(job_id, client),
         )
-        response.raise_for_status()
-        job_status = response.json()["results"][0]
+    except requests.HTTPError as error:
+        if not _already_submitted(error):
+            raise
+        log.info("Job id = %s was already submitted", job_id)
+
 
-        # It takes a while before cluster statuses are available
-        while True:
-            response = requests.get(
-                f"https://{apispec.basehost}/api/v2/jobs/{job_id}/cluster_statuses/",
-                headers={"Authorization": f"Token {apispec.apikey}"},
+class _JobTracker:
+    """Status and phase bookkeeping for a single monitored job"""
+
+    def __init__(self, job_id: str, now: float):
+        self.job_id = job_id
+        self.started = now
+        self.phase = None
+        self.phase_started = now
+        self.last_statuses = None
+        self.unchanged_polls = 0
+        self.next_poll = now
+        self.errors = 0
+        self.error: Optional[Exception] = None
+        self.timeline = []
+
+    def update(self, job_status: str, cluster_status: Optional[str], now: float):
+        if (job_status, cluster_status) != self.last_statuses:
+            self.last_statuses, self.unchanged_polls = (job_status, cluster_status), 0
+            self.timeline.append(
+                (round(now - self.started, 3), job_status, cluster_status)
             )
-            if response.status_code == 404:
-                time.sleep(5)
-            else:
-                break
+            log.info("Status (job %s): %s", self.job_id, job_status)
+            log.info(
+                "Status (cluster %s): %s",
+                self.job_id,
+                cluster_status or "Not available",
+            )
+        else:
+            self.unchanged_polls += 1
 
-        response.raise_for_status()
-        cluster_status = response.json()["results"][0]
+        phase = _job_phase(job_status, cluster_status)
+        if phase != self.phase:
+            self.phase, self.phase_started = phase, now
+
+    def schedule(self, policy: PollPolicy, now: float):
+        self.next_poll = now + policy.next_interval(
+            self.phase, self.unchanged_polls, now - self.phase_started
+        )
 
-        log.info("Status (job): %s", job_status["status"])
-        log.info("Status (cluster): %s", cluster_status["status"])
 
-        if job_status["status"] == "Completed":
-            log.info("Job %s completed", job_id)
-            break
+def _fetch_statuses(job_id: str, client: RescaleClient):
+    response = client.get("status", f"/api/v2/jobs/{job_id}/statuses/")
+    response.raise_for_status()
+    job_status = response.json()["results"][0]["status"]
+    if job_status == "Completed":
+        return job_status, None
+
+    # It takes a while before cluster statuses are available
+    response = client.get("status", f"/api/v2/jobs/{job_id}/cluster_statuses/")
+    if response.status_code == 404:
+        return job_status, None
+    response.raise_for_status()
+    return job_status, response.json()["results"][0]["status"]
+
+
+class JobMonitor:
+    """Single asyncio poller multiplexing status checks for many jobs
+
+    Jobs can be added at any time, also while ``run_async`` is in progress.
+    Adding a job that is already tracked only registers more callbacks, so
+    each job is polled once per cycle. Due jobs are fetched concurrently with
+    at most ``max_in_flight`` requests outstanding; the blocking requests run
+    on a thread pool while scheduling happens in the event loop. Completion
+    callbacks run on their own threads so polling never waits for downstream
+    steps. ``sleep`` must be awaitable.
+    """
+
+    def __init__(
+        self,
+        client: RescaleClient,
+        policy: Optional[PollPolicy] = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        sleep=asyncio.sleep,
+        clock=time.monotonic,
+    ):
+        self.client = client
+        self.policy = policy or AdaptivePollPolicy()
+        self.max_in_flight = max_in_flight
+        self.sleep = sleep
+        self.clock = clock
+        self.pending: Dict[str, _JobTracker] = {}
+        self.callbacks: Dict[str, list] = {}
+        self.poll_hooks: Dict[str, list] = {}
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+        self.timelines: Dict[str, list] = {}
+        self.failures: Dict[str, Exception] = {}
+        self.closed = False
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def add(self, job_id: str, on_complete=None, on_poll=None):
+        """Track ``job_id``
+
+        ``on_complete(job_id, timeline)`` is called once the job completes and
+        ``on_poll(job_id, phase)`` after every status poll before that.
+        """
+        if job_id not in self.pending:
+            self.pending[job_id] = _JobTracker(job_id, self.clock())
+        if on_complete is not None:
+            self.callbacks.setdefault(job_id, []).append(on_complete)
+        if on_poll is not None:
+            self.poll_hooks.setdefault(job_id, []).append(on_poll)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def wait(self, job_id: str, on_poll=None):
+        """Track ``job_id`` and return its status timeline once it completes"""
+        if job_id in self.timelines:
+            return self.timelines[job_id]
+        if job_id in self.failures:
+            raise self.failures[job_id]
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(job_id, []).append(waiter)
+        self.add(job_id, on_poll=on_poll)
+        return await waiter
+
+    def close(self):
+        """Let ``run_async`` return once the tracked jobs complete"""
+        self.closed = True
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def _poll(self, tracker, fetchers, slots):
+        loop = asyncio.get_running_loop()
+        async with slots:
+            try:
+                statuses = await loop.run_in_executor(
+                    fetchers, _fetch_statuses, tracker.job_id, self.client
+                )
+            except requests.RequestException as error:
+                # The client already retried; keep polling the other jobs and
+                # try this one again on its next turn
+                tracker.errors += 1
+                if tracker.errors > MONITOR_MAX_ERRORS:
+                    tracker.error = error
+                    return
+                log.info("Status check of job %s failed: %s", tracker.job_id, error)
+                tracker.unchanged_polls += 1
+                tracker.schedule(self.policy, self.clock())
+                return
+        tracker.errors = 0
+        tracker.update(*statuses, self.clock())
+        if tracker.phase == PHASE_COMPLETED:
+            return
+        for hook in self.poll_hooks.get(tracker.job_id, []):
+            try:
+                await loop.run_in_executor(
+                    fetchers, hook, tracker.job_id, tracker.phase
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                log.debug("Poll hook for job %s failed: %s", tracker.job_id, error)
+        tracker.schedule(self.policy, self.clock())
+
+    def _complete(self, tracker, runners, callback_futures):
+        log.info("Job %s completed", tracker.job_id)
+        loop = asyncio.get_running_loop()
+        del self.pending[tracker.job_id]
+        self.poll_hooks.pop(tracker.job_id, None)
+        self.timelines[tracker.job_id] = tracker.timeline
+        for waiter in self.waiters.pop(tracker.job_id, []):
+            if not waiter.done():
+                waiter.set_result(tracker.timeline)
+        for callback in self.callbacks.pop(tracker.job_id, []):
+            callback_futures.append(
+                loop.run_in_executor(
+                    runners, callback, tracker.job_id, tracker.timeline
+                )
+            )
+
+    def _fail(self, tracker):
+        """Stop tracking a job whose status checks keep failing"""
+        log.error("Monitoring job %s failed: %r", tracker.job_id, tracker.error)
+        del self.pending[tracker.job_id]
+        self.poll_hooks.pop(tracker.job_id, None)
+        self.callbacks.pop(tracker.job_id, None)
+        self.failures[tracker.job_id] = tracker.error
+        for waiter in self.waiters.pop(tracker.job_id, []):
+            if not waiter.done():
+                waiter.set_exception(tracker.error)
+
+    async def _idle(self, delay: Optional[float]):
+        """Sleep until the next poll is due or a job is added"""
+        self.wakeup.clear()
+        waits = [asyncio.ensure_future(self.wakeup.wait())]
+        if delay is not None:
+            waits.append(asyncio.ensure_future(self.sleep(delay)))
+        _, pending = await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+
+    async def run_async(self):
+        """Poll until closed and every tracked job completed
+
+        Returns the status timeline of every completed job, keyed by job id.
+        A job whose status checks fail more than MONITOR_MAX_ERRORS times in a
+        row is dropped, its waiters get the error, which is also kept in
+        ``failures``; the other jobs are polled on. Any other error is
+        propagated to every waiter and then raised.
+        """
+        self.wakeup = asyncio.Event()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        callback_futures = []
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as fetchers, \
+                ThreadPoolExecutor(max_workers=self.max_in_flight) as runners:
+            try:
+                while self.pending or not self.closed:
+                    now = self.clock()
+                    due = [t for t in self.pending.values() if t.next_poll <= now]
+                    await asyncio.gather(*(self._poll(t, fetchers, slots) for t in due))
+                    for tracker in due:
+                        if tracker.error is not None:
+                            self._fail(tracker)
+                        elif tracker.phase == PHASE_COMPLETED:
+                            self._complete(tracker, runners, callback_futures)
+
+                    if self.pending or not self.closed:
+                        next_poll = min(
+                            (t.next_poll for t in self.pending.values()), default=None
+                        )
+                        if next_poll is not None:
+                            next_poll = max(0, next_poll - self.clock())
+                        await self._idle(next_poll)
+            except Exception as error:
+                for waiters in self.waiters.values():
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(error)
+                raise
+
+            for future in callback_futures:
+                try:
+                    await future
+                except Exception as error:  # pylint: disable=broad-except
+                    log.error("Completion callback failed: %s", error)
+        return self.timelines
+
+    def run(self):
+        """Synchronously poll until every tracked job completes"""
+        self.close()
+        return asyncio.run(self.run_async())
 
-        time.sleep(status_poll_sleep)
 
+def _monitor_job(
+    job_id: str,
+    client: RescaleClient,
+    policy: Optional[PollPolicy] = None,
+    sleep=asyncio.sleep,
+    clock=time.monotonic,
+    on_poll=None,
+):
+    """Poll job and cluster status until the job completes
 
-def _link_outfile_with_folder(job_id: str, apispec: ApiSpec):
-    images_folder_name = "apptainer_images"
+    Returns the observed status timeline as a list of
+    ``(elapsed seconds, job status, cluster status)`` transitions.
+    """
+    monitor = JobMonitor(client, policy, max_in_flight=1, sleep=sleep, clock=clock)
+    monitor.add(job_id, on_poll=on_poll)
+    timelines = monitor.run()
+    if job_id in monitor.failures:
+        raise monitor.failures[job_id]
+    return timelines[job_id]
 
-    response = requests.get(
-        f"https://{apispec.basehost}/api/v2/jobs/{job_id}/files/?search=sif",
-        headers={"Authorization": f"Token {apispec.apikey}"},
+
+def _find_job_files(job_id: str, client: RescaleClient, search: str):
+    return _paginate(
+        client,
+        "files",
+        f"/api/v2/jobs/{job_id}/files/",
+        {"search": search, "page_size": PAGE_SIZE},
     )
-    response.raise_for_status()
-    files = response.json()["results"]
-    if len(files) != 1:
-        log.info("A single matching .sif file expected")
-        raise Exception()
-    sif_file_id = response.json()["results"][0]["id"]
 
+
+def _find_sif_file_id(job_id: str, client: RescaleClient) -> Optional[str]:
+    """Id of the single .sif output of a job, None if there is not exactly one"""
+    sif_files = []
+    for file in _find_job_files(job_id, client, "sif"):
+        if file["name"].endswith(".sif"):
+            sif_files.append(file)
+            if len(sif_files) > 1:
+                return None
+    return sif_files[0]["id"] if sif_files else None
+
+
+def _has_sif_output(job_id: str, client: RescaleClient) -> bool:
+    try:
+        return _find_sif_file_id(job_id, client) is not None
+    except requests.HTTPError as error:
+        if error.response is not None and error.response.status_code == 404:
+            return False
+        raise
+
+
+class FolderCache:
+    """Folder name -> folder id, persisted with a TTL and memoized in-process
+
+    Concurrent builds share one instance; the first one to resolve a folder
+    does the API lookup while the others wait for its result, after which
+    every lookup is free until the entry expires or is invalidated.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(CACHE_DIR, "folders.json"),
+        ttl_days: float = FOLDER_CACHE_TTL_DAYS,
+    ):
+        self.store = _JsonStore(path)
+        self.ttl = ttl_days * 24 * 3600
+        self.memo: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str, client: RescaleClient) -> str:
+        with self.lock:
+            if name in self.memo:
+                return self.memo[name]
+            entry = self.store.data.get(name)
+            if entry is not None and time.time() - entry["cached"] < self.ttl:
+                self.memo[name] = entry["id"]
+                return entry["id"]
+
+            folder_id = _find_or_create_folder(name, client)
+            self.memo[name] = folder_id
+            self.store.data[name] = {"id": folder_id, "cached": time.time()}
+            self.store.save()
+            return folder_id
+
+    def invalidate(self, name: str, folder_id: str):
+        """Forget ``folder_id`` unless another build already replaced it"""
+        with self.lock:
+            if self.memo.get(name) == folder_id:
+                del self.memo[name]
+            if self.store.data.get(name, {}).get("id") == folder_id:
+                del self.store.data[name]
+                self.store.save()
+
+
+def _find_or_create_folder(name: str, client: RescaleClient) -> str:
     # Get folders
-    response = requests.get(
-        f"https://{apispec.basehost}/api/v3/file-folders/",
-        headers={"Authorization": f"Token {apispec.apikey}"},
+    folder = next(
+        (
+            f
+            for f in _paginate(client, "folders", "/api/v3/file-folders/")
+            if f["name"] == name
+        ),
+        None,
     )
-    response.raise_for_status()
-    folders = response.json()
-    images_folder = [f for f in folders if f["name"] == images_folder_name]
-
-    if len(images_folder) == 0: 
-        # Create folder
-        response = requests.post(
-            f"https://{apispec.basehost}/api/v3/file-folders/",
-            json={"name": images_folder_name, "parentId": None},
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Token {apispec.apikey}",
-            },
-        )
-        # Ignore folder exists 400
-        if response.status_code not in (201, 400):
-            response.raise_for_status()
-        folder_id = response.json()["id"]
-    else:
-        folder_id = images_folder[0]["id"]
+    if folder is not None:
+        return folder["id"]
 
-    # Assign file to folder
-    response = requests.post(
-        f"https://{apispec.basehost}/api/v3/file-folders/{folder_id}/files/",
-        json={"ids": [f"{sif_file_id}"]},
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Token {apispec.apikey}",
-        },
+    # Create folder
+    # Creating an existing folder fails with 400, so retrying is safe
+    response = client.post(
+        "folders",
+        "/api/v3/file-folders/",
+        idempotent=True,
+        json={"name": name, "parentId": None},
     )
-    response.raise_for_status()
+    # Ignore folder exists 400
+    if response.status_code not in (201, 400):
+        response.raise_for_status()
+    return response.json()["id"]
 
-    # Tag file as input file
-    response = requests.post(
-        f"https://{apispec.basehost}/api/v3/files/bulk/type-change/",
-        json={"ids": [f"{sif_file_id}"], "type": 1},
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Token {apispec.apikey}",
-        },
-    )
+
+def _assign_to_folder(
+    file_ids: List[str], client: RescaleClient, folder_cache: Optional[FolderCache]
+):
+    # A cached folder id may point to a deleted folder
+    for attempt in range(2 if folder_cache is not None else 1):
+        if folder_cache is not None:
+            folder_id = folder_cache.get(IMAGES_FOLDER_NAME, client)
+        else:
+            folder_id = _find_or_create_folder(IMAGES_FOLDER_NAME, client)
+        response = client.post(
+            "folders",
+            f"/api/v3/file-folders/{folder_id}/files/",
+            idempotent=True,
+            json={"ids": [f"{file_id}" for file_id in file_ids]},
+        )
+        if response.status_code != 404 or folder_cache is None or attempt:
+            break
+        log.info("Cached folder id = %s no longer exists", folder_id)
+        folder_cache.invalidate(IMAGES_FOLDER_NAME, folder_id)
     response.raise_for_status()
 
 
-def _display_process_output(job_id: str, apispec: ApiSpec):
-    response = requests.get(
-        f"https://{apispec.basehost}/api/v2/jobs/{job_id}/files/"
-        "?search=process_output&page=1&page_size=10",
-        headers={"Authorization": f"Token {apispec.apikey}"},
+def _tag_as_input_files(file_ids: List[str], client: RescaleClient):
+    response = client.post(
+        "files",
+        "/api/v3/files/bulk/type-change/",
+        idempotent=True,
+        json={"ids": [f"{file_id}" for file_id in file_ids], "type": 1},
     )
     response.raise_for_status()
-    file_id = response.json()["results"][0]["id"]
 
-    response = requests.get(
-        f"https://{apispec.basehost}/api/v2/files/{file_id}/lines/",
-        headers={"Authorization": f"Token {apispec.apikey}"},
+
+def _link_files_with_folder(
+    file_ids: List[str],
+    client: RescaleClient,
+    folder_cache: Optional[FolderCache] = None,
+) -> Dict[str, Exception]:
+    """Assign files to the images folder and tag them as input files
+
+    Both endpoints take a list of ids, so any number of files costs two
+    calls. When a bulk call fails, the files are retried one by one to find
+    out which of them are at fault. Returns the error per failed file id.
+    """
+    failures = {}
+    for step in (
+        lambda ids: _assign_to_folder(ids, client, folder_cache),
+        lambda ids: _tag_as_input_files(ids, client),
+    ):
+        remaining = [file_id for file_id in file_ids if file_id not in failures]
+        if not remaining:
+            break
+        try:
+            step(remaining)
+        except requests.RequestException as bulk_error:
+            if len(remaining) == 1:
+                failures[remaining[0]] = bulk_error
+                continue
+            for file_id in remaining:
+                try:
+                    step([file_id])
+                except requests.RequestException as error:
+                    failures[file_id] = error
+    return failures
+
+
+def _link_outfile_with_folder(
+    job_id: str, client: RescaleClient, folder_cache: Optional[FolderCache] = None
+):
+    sif_file_id = _find_sif_file_id(job_id, client)
+    if sif_file_id is None:
+        log.info("A single matching .sif file expected")
+        raise Exception()
+
+    failures = _link_files_with_folder([sif_file_id], client, folder_cache)
+    if failures:
+        raise failures[sif_file_id]
+
+
+class SifLinker:
+    """Accumulates completed SIF file ids and links them in batches
+
+    A batch is flushed once ``batch_size`` ids are pending or ``max_delay``
+    seconds after its first id was added, whichever comes first, and on
+    ``close``. ``on_done(file_id, error)`` passed to ``add`` is called after
+    the flush, with ``error`` None on success.
+    """
+
+    def __init__(
+        self,
+        client: RescaleClient,
+        folder_cache: Optional[FolderCache] = None,
+        batch_size: int = LINK_BATCH_SIZE,
+        max_delay: float = LINK_BATCH_DELAY,
+    ):
+        self.client = client
+        self.folder_cache = folder_cache
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pending = []
+        self.timer = None
+
+    def add(self, file_id: str, on_done=None):
+        with self.lock:
+            self.pending.append((file_id, on_done))
+            if len(self.pending) < self.batch_size:
+                if self.timer is None:
+                    self.timer = threading.Timer(self.max_delay, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not batch:
+            return
+
+        file_ids = list(dict.fromkeys(file_id for file_id, _ in batch))
+        log.info("Linking %d image files with %s", len(file_ids), IMAGES_FOLDER_NAME)
+        try:
+            failures = _link_files_with_folder(file_ids, self.client, self.folder_cache)
+        except Exception as error:  # pylint: disable=broad-except
+            failures = dict.fromkeys(file_ids, error)
+
+        for file_id, on_done in batch:
+            if file_id in failures:
+                log.error("Linking file %s failed: %s", file_id, failures[file_id])
+            if on_done is not None:
+                on_done(file_id, failures.get(file_id))
+
+    def close(self):
+        self.flush()
+
+
+class _LogFollower:
+    """Prints new process output lines of a running job as they appear
+
+    Used as a JobMonitor poll hook. Every call fetches the last ``window``
+    lines of the live log through the run tail endpoint and aligns them with
+    the lines seen on the previous call, so only new lines are printed and
+    at most ``window`` lines are held in memory. The tail endpoint has no
+    offset parameter, so each call downloads the whole window again.
+    """
+
+    def __init__(self, client: RescaleClient, window: int = TAIL_LINES):
+        self.client = client
+        self.window = window
+        self.recent = collections.deque(maxlen=window)
+        self.skipped = False
+
+    def __call__(self, job_id: str, phase: str):
+        if phase not in (PHASE_RUNNING, PHASE_STAGING):
+            return
+        response = self.client.get(
+            "lines",
+            f"/api/v2/jobs/{job_id}/runs/1/tail/process_output.log",
+            params={"lines": self.window},
+        )
+        if response.status_code == 404:
+            return
+        response.raise_for_status()
+
+        new_lines = self._new_lines(response.json()["lines"])
+        for line in new_lines:
+            print(line, end="")
+        self.recent.extend(new_lines)
+
+    def _new_lines(self, lines: List[str]) -> List[str]:
+        recent = list(self.recent)
+        for start in range(max(0, len(recent) - len(lines)), len(recent)):
+            overlap = len(recent) - start
+            if recent[start:] == lines[:overlap]:
+                return lines[overlap:]
+        if len(lines) == self.window:
+            # The log may hold more lines than the window returned
+            self.skipped = True
+            if recent:
+                print("[... output may have been skipped, polling fell behind ...]")
+        return lines
+
+    def remaining(self, lines: List[str]) -> List[str]:
+        """Lines of the complete log ``lines`` that were not printed yet
+
+        The lines after the last occurrence of the recently printed ones, or
+        all of them when lines may have been skipped while following.
+        """
+        recent = list(self.recent)
+        if self.skipped:
+            print("[... complete process output, lines were skipped above ...]")
+            return lines
+        if not recent:
+            return lines
+        for end in range(len(lines), len(recent) - 1, -1):
+            if lines[end - len(recent) : end] == recent:
+                return lines[end:]
+        return lines
+
+
+def _display_process_output(
+    job_id: str, client: RescaleClient, follower: Optional[_LogFollower] = None
+) -> List[str]:
+    """Print the process output of a job, returning all of its lines
+
+    Lines the ``follower`` already printed while the job ran are left out.
+    """
+    # A StopIteration would not propagate out of the executor future
+    file_id = next(
+        (
+            f["id"]
+            for f in _find_job_files(job_id, client, "process_output")
+            if f["name"].startswith("process_output")
+        ),
+        None,
     )
+    if file_id is None:
+        raise Exception(f"Job {job_id} has no process output file")
+
+    response = client.get("lines", f"/api/v2/files/{file_id}/lines/")
     response.raise_for_status()
-    for line in response.json()["lines"]:
+    lines = response.json()["lines"]
+    for line in follower.remaining(lines) if follower is not None else lines:
         print(line, end='')
+    return lines
 
 
-def _build_image(jobspec: JobSpec, apispec: ApiSpec):
-    file_ids = []
-    for filepath in [jobspec.buildscript_path, jobspec.deffile_path]:
-        file_id = _upload_file(filepath, apispec.apikey, apispec.basehost)
-        file_ids.append(file_id)
+def _parse_build_usage(lines: List[str]) -> Optional[dict]:
+    """Resource usage the build script reports in its BUILD_USAGE line"""
+    for line in reversed(lines):
+        if line.startswith("BUILD_USAGE "):
+            return {
+                key: float(value)
+                for key, value in re.findall(r"(\w+)=([\d.]+)", line)
+            }
+    return None
+
 
-    job_id = _create_build_job(file_ids, jobspec, apispec)
-    _submit_build_job(job_id, apispec)
-    _monitor_job(job_id, apispec)
-    _link_outfile_with_folder(job_id, apispec)
-    _display_process_output(job_id, apispec)
+def _load_manifest(manifest_path: str) -> List[JobSpec]:
+    """Read image build definitions from a JSON or YAML manifest
 
+    The manifest holds an ``images`` list with ``deffile``, ``buildscript``
+    and ``jobname`` per image, plus optional ``inputs``, ``source_dir``,
+    ``project``, ``coretype``, ``core_count``, ``walltime`` and
+    ``compression`` which default to the top-level ``defaults`` mapping and
+    then to the module constants.
+    Relative paths are resolved against the manifest directory.
+    """
+    with open(manifest_path, encoding="utf-8") as file:
+        if manifest_path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required to read YAML manifests")
+            manifest = yaml.safe_load(file)
+        else:
+            manifest = json.load(file)
+
+    basedir = os.path.dirname(os.path.abspath(manifest_path))
+    defaults = {
+        "project": None,
+        "coretype": CORETYPE,
+        "core_count": CORE_COUNT,
+        "walltime": WALLTIME,
+    }
+    defaults.update(manifest.get("defaults", {}))
+
+    jobspecs = []
+    for image in manifest["images"]:
+        image = {**defaults, **image}
+        input_paths = [os.path.join(basedir, path) for path in image.get("inputs", [])]
+        if image.get("source_dir"):
+            input_paths.append(_pack_source(os.path.join(basedir, image["source_dir"])))
+        jobspecs.append(
+            JobSpec(
+                image["jobname"],
+                os.path.join(basedir, image["deffile"]),
+                os.path.join(basedir, image["buildscript"]),
+                image["project"],
+                ANALYSIS_CODE,
+                ANALYSIS_VERSION,
+                image["coretype"],
+                int(image["core_count"]),
+                int(image["walltime"]),
+                tuple(input_paths),
+                _parse_compression(image["compression"])
+                if image.get("compression")
+                else None,
+            )
+        )
+    return jobspecs
+
+
+def _pack_source(source_dir: str, archive_dir: Optional[str] = None) -> str:
+    """Pack a source tree into a reproducible SOURCE_ARCHIVE job input
+
+    Entries are sorted and their timestamps and ownership cleared, so an
+    unchanged tree always produces a byte-identical archive whose upload the
+    upload cache deduplicates by content hash. SOURCE_EXCLUDES directories
+    are left out. Returns the archive path, which is reused per source tree.
+    """
+    source_dir = os.path.abspath(source_dir)
+    if archive_dir is None:
+        tree_id = hashlib.sha256(source_dir.encode()).hexdigest()[:16]
+        archive_dir = os.path.join(CACHE_DIR, "sources", tree_id)
+    os.makedirs(archive_dir, exist_ok=True)
+    archive_path = os.path.join(archive_dir, SOURCE_ARCHIVE)
+
+    def normalize(info: tarfile.TarInfo) -> tarfile.TarInfo:
+        info.mtime = 0
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        return info
+
+    tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as raw, gzip.GzipFile(
+        fileobj=raw, mode="wb", mtime=0
+    ) as compressed, tarfile.open(fileobj=compressed, mode="w") as archive:
+        for root, dirs, files in os.walk(source_dir):
+            dirs[:] = sorted(d for d in dirs if d not in SOURCE_EXCLUDES)
+            for name in [*dirs, *sorted(files)]:
+                path = os.path.join(root, name)
+                archive.add(
+                    path,
+                    os.path.relpath(path, source_dir),
+                    recursive=False,
+                    filter=normalize,
+                )
+    os.replace(tmp_path, archive_path)
+    log.info(
+        "Packed %s into %s (%.1f MB)",
+        source_dir,
+        archive_path,
+        os.path.getsize(archive_path) / 1e6,
+    )
+    return archive_path
+
+
+def _upload_files(
+    filepaths: List[str],
+    client: RescaleClient,
+    cache: Optional[UploadCache] = None,
+    workers: int = UPLOAD_WORKERS,
+) -> List[str]:
+    """Upload files concurrently, returning their ids in ``filepaths`` order"""
+    total_bytes = sum(os.path.getsize(path) for path in filepaths)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        file_ids = list(
+            executor.map(lambda path: _upload_file(path, client, cache), filepaths)
+        )
+    elapsed = max(time.monotonic() - started, 1e-6)
+    log.info(
+        "Uploaded %d input files (%d bytes) in %.1f s, %.1f MB/s aggregate",
+        len(filepaths),
+        total_bytes,
+        elapsed,
+        total_bytes / elapsed / 1e6,
+    )
+    return file_ids
+
+
+def _submit_image(
+    jobspec: JobSpec,
+    client: RescaleClient,
+    upload_cache: Optional[UploadCache] = None,
+    fingerprint: Optional[str] = None,
+    upload_workers: int = UPLOAD_WORKERS,
+    journal: Optional[RunJournal] = None,
+    record: Optional[dict] = None,
+    attached_file_ids: Tuple[str, ...] = (),
+):
+    """Upload, create and submit, skipping the stages ``record`` has reached
+
+    ``attached_file_ids`` are existing files added to the job inputs.
+    """
+    record = record if record is not None else {}
+    if _stage_reached(record, "uploaded"):
+        file_ids = record["file_ids"]
+    else:
+        with _span(client, "upload", jobspec.name):
+            file_ids = _upload_files(
+                [jobspec.buildscript_path, jobspec.deffile_path, *jobspec.input_paths],
+                client,
+                upload_cache,
+                upload_workers,
+            )
+        _checkpoint(journal, record, "uploaded", file_ids=file_ids)
+
+    resumed_job = _stage_reached(record, "created")
+    if resumed_job:
+        job_id = record["job_id"]
+    else:
+        with _span(client, "create", jobspec.name):
+            job_id = _create_build_job(
+                [*file_ids, *attached_file_ids], jobspec, client, fingerprint
+            )
+        _checkpoint(journal, record, "created", job_id=job_id)
+
+    if not _stage_reached(record, "submitted"):
+        with _span(client, "submit", jobspec.name):
+            # The interrupted run may have submitted the job before
+            # checkpointing it
+            if resumed_job and _job_was_submitted(job_id, client):
+                log.info("Job id = %s was already submitted", job_id)
+            else:
+                _submit_build_job(job_id, client)
+        _checkpoint(journal, record, "submitted")
+    return job_id
+
+
+def _reuse_previous_build(
+    jobspec: JobSpec,
+    fingerprint: str,
+    client: RescaleClient,
+    build_cache: Optional[BuildCache],
+    folder_cache: Optional[FolderCache] = None,
+    linker: Optional[SifLinker] = None,
+) -> bool:
+    """Link the SIF of an earlier identical build instead of rebuilding
+
+    With a ``linker`` the SIF is queued for the next batched link instead.
+    Builds of unpinned sources are never reused, as upstream may have changed.
+    """
+    if build_cache is None:
+        return False
+    if not _source_pinned(jobspec):
+        log.info(
+            "%s does not pin a source revision, rebuilding %s",
+            jobspec.buildscript_path,
+            jobspec.name,
+        )
+        return False
+    job_id = build_cache.lookup(fingerprint, jobspec.name, client)
+    if job_id is None:
+        return False
+
+    log.info("Image %s is unchanged, reusing SIF built by job %s", jobspec.name, job_id)
+    if linker is None:
+        _link_outfile_with_folder(job_id, client, folder_cache)
+    else:
+        linker.add(_find_sif_file_id(job_id, client))
+    return True
+
+
+class BuildPipeline:
+    """Asyncio engine driving the whole build lifecycle of many images
+
+    Each image goes through awaitable stages: reuse lookup, upload, create
+    and submit, monitor, link and process output display. Images proceed
+    independently, so uploads of one image overlap the monitoring of others,
+    while the status polls of all jobs are multiplexed by one JobMonitor in
+    the event loop. Blocking API calls run on a bounded thread pool sharing
+    the pooled client; at most ``workers`` images are uploaded and submitted
+    at the same time. With ``detach`` the images are only submitted and their
+    job ids collected in ``job_ids``, leaving monitoring and finalizing to a
+    later ``wait`` and ``finalize``.
+    """
+
+    def __init__(
+        self,
+        client: RescaleClient,
+        policy: Optional[PollPolicy] = None,
+        workers: int = WORKERS,
+        upload_cache: Optional[UploadCache] = None,
+        build_cache: Optional[BuildCache] = None,
+        folder_cache: Optional[FolderCache] = None,
+        follow: bool = False,
+        journal: Optional[RunJournal] = None,
+        detach: bool = False,
+        artifact_caches: Optional[List[ArtifactCache]] = None,
+        history: Optional[BuildHistory] = None,
+    ):
+        self.client = client
+        self.artifact_caches = artifact_caches or []
+        self.history = history
+        self.journal = journal
+        self.detach = detach
+        self.records = []
+        self.job_ids: Dict[str, Optional[str]] = {}
+        self.timelines: Dict[str, list] = {}
+        self.workers = workers
+        self.upload_cache = upload_cache
+        self.build_cache = build_cache
+        self.folder_cache = folder_cache
+        self.follow = follow
+        if follow:
+            policy = CappedPollPolicy(
+                policy or AdaptivePollPolicy(),
+                FOLLOW_INTERVAL,
+                (PHASE_RUNNING, PHASE_STAGING),
+            )
+        self.monitor = JobMonitor(client, policy)
+        self.executor = ThreadPoolExecutor(max_workers=workers + MAX_IN_FLIGHT)
+        self.failed: List[str] = []
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def build(
+        self,
+        jobspec: JobSpec,
+        submit_slots: asyncio.Semaphore,
+        output_lock: asyncio.Lock,
+        linker: Optional[SifLinker] = None,
+    ) -> Optional[str]:
+        """Build one image, returning its job id or None if a SIF was reused
+
+        Stages already completed according to the journal are skipped.
+        """
+        async with submit_slots:
+            fingerprint = await self._call(_build_fingerprint, jobspec)
+            record = (
+                self.journal.start(jobspec.name, fingerprint)
+                if self.journal is not None
+                else {}
+            )
+            self.records.append(record)
+            if _stage_reached(record, "done"):
+                job_id = record["job_id"]
+                log.info("%s was already built by job %s", jobspec.name, job_id)
+                self.job_ids[jobspec.name] = job_id
+                return job_id
+
+            if not _stage_reached(record, "created"):
+                with _span(self.client, "reuse_lookup", jobspec.name):
+                    reused = await self._call(
+                        _reuse_previous_build,
+                        jobspec,
+                        fingerprint,
+                        self.client,
+                        self.build_cache,
+                        self.folder_cache,
+                        linker,
+                    )
+                if reused:
+                    self.job_ids[jobspec.name] = None
+                    return None
+            attached = []
+            if not _stage_reached(record, "created"):
+                record["jobspec"] = jobspec._asdict()
+                record["cache_keys"] = {}
+                for cache in self.artifact_caches:
+                    key = cache.key(jobspec)
+                    record["cache_keys"][cache.archive] = key
+                    file_id = await self._call(cache.lookup, key, self.client)
+                    if file_id is not None:
+                        attached.append(file_id)
+            job_id = await self._call(
+                _submit_image,
+                jobspec,
+                self.client,
+                self.upload_cache,
+                fingerprint,
+                UPLOAD_WORKERS,
+                self.journal,
+                record,
+                tuple(attached),
+            )
+            self.job_ids[jobspec.name] = job_id
+        if self.detach:
+            return job_id
+
+        follower = _LogFollower(self.client) if self.follow else None
+        timeline = None
+        if not _stage_reached(record, "completed"):
+            with _span(self.client, "monitor", jobspec.name):
+                timeline = await self.monitor.wait(job_id, on_poll=follower)
+            _checkpoint(self.journal, record, "completed", timeline=timeline)
+            if self.client.recorder is not None:
+                self.client.recorder.record_job(job_id, timeline, jobspec.name)
+            self.timelines[jobspec.name] = timeline
+            for cache in self.artifact_caches:
+                await self._call(cache.harvest, cache.key(jobspec), job_id, self.client)
+
+        if _stage_reached(record, "linked"):
+            pass
+        elif linker is None:
+            with _span(self.client, "link", jobspec.name):
+                await self._call(
+                    _link_outfile_with_folder, job_id, self.client, self.folder_cache
+                )
+            _checkpoint(self.journal, record, "linked")
+            if self.build_cache is not None:
+                self.build_cache.add(fingerprint, job_id)
+        else:
+            with _span(self.client, "link", jobspec.name):
+                sif_file_id = await self._call(_find_sif_file_id, job_id, self.client)
+            if sif_file_id is None:
+                raise Exception("A single matching .sif file expected")
+
+            def linked(_file_id, error):
+                if error is not None:
+                    self.failed.append(jobspec.name)
+                    return
+                _checkpoint(self.journal, record, "linked")
+                if self.build_cache is not None:
+                    self.build_cache.add(fingerprint, job_id)
+
+            linker.add(sif_file_id, linked)
+
+        async with output_lock:
+            if linker is not None:
+                log.info("Process output of %s (job %s)", jobspec.name, job_id)
+            with _span(self.client, "output", jobspec.name):
+                lines = await self._call(
+                    _display_process_output,
+                    job_id,
+                    self.client,
+                    follower,
+                )
+        if self.history is not None and timeline is not None:
+            self.history.add(jobspec, job_id, timeline, _parse_build_usage(lines))
+        if linker is None:
+            _checkpoint(self.journal, record, "done")
+        return job_id
+
+    async def run(
+        self, jobspecs: List[JobSpec], timeline_path: Optional[str] = None
+    ) -> List[str]:
+        """Build all images, returning the names of those that failed
+
+        A single image is linked directly and its failure is raised; several
+        images share a SifLinker and failures are logged and collected. The
+        status timeline of a single image is written to ``timeline_path``,
+        those of several images as an object keyed by image name.
+        """
+        submit_slots = asyncio.Semaphore(self.workers)
+        output_lock = asyncio.Lock()
+        linker = None
+        if len(jobspecs) > 1:
+            linker = SifLinker(self.client, self.folder_cache)
+
+        monitor_task = asyncio.ensure_future(self.monitor.run_async())
+        try:
+            results = await asyncio.gather(
+                *(
+                    self.build(jobspec, submit_slots, output_lock, linker)
+                    for jobspec in jobspecs
+                ),
+                return_exceptions=linker is not None,
+            )
+        finally:
+            self.monitor.close()
+            try:
+                await monitor_task
+            except Exception as error:  # pylint: disable=broad-except
+                # The waiting builds already got the error, link the others
+                log.error("Job monitoring failed: %r", error)
+            try:
+                if linker is not None:
+                    with _span(self.client, "link_flush"):
+                        await self._call(linker.close)
+            finally:
+                self.executor.shutdown()
+
+        if timeline_path and self.timelines:
+            with open(timeline_path, "w", encoding="utf-8") as file:
+                json.dump(
+                    self.timelines
+                    if len(jobspecs) > 1
+                    else self.timelines[jobspecs[0].name],
+                    file,
+                    indent=2,
+                )
+
+        if linker is not None and not self.detach:
+            for record in self.records:
+                if _stage_reached(record, "linked"):
+                    _checkpoint(self.journal, record, "done")
+
+        for jobspec, result in zip(jobspecs, results):
+            if isinstance(result, Exception):
+                log.error("Building %s failed: %r", jobspec.name, result)
+                self.failed.append(jobspec.name)
+        return self.failed
+
+
+def _build_image(
+    jobspec: JobSpec,
+    apispec: ApiSpec,
+    pool_size: int = POOL_SIZE,
+    policy: Optional[PollPolicy] = None,
+    timeline_path: Optional[str] = None,
+    upload_cache: Optional[UploadCache] = None,
+    build_cache: Optional[BuildCache] = None,
+    follow: bool = False,
+    folder_cache: Optional[FolderCache] = None,
+    journal: Optional[RunJournal] = None,
+    recorder: Optional[RunRecorder] = None,
+    artifact_caches: Optional[List[ArtifactCache]] = None,
+    history: Optional[BuildHistory] = None,
+):
+    """Synchronous wrapper building a single image with BuildPipeline"""
+    with RescaleClient(
+        apispec, pool_size=max(pool_size, UPLOAD_WORKERS), recorder=recorder
+    ) as client:
+        pipeline = BuildPipeline(
+            client,
+            policy,
+            workers=1,
+            upload_cache=upload_cache,
+            build_cache=build_cache,
+            folder_cache=folder_cache,
+            follow=follow,
+            journal=journal,
+            artifact_caches=artifact_caches,
+            history=history,
+        )
+        asyncio.run(pipeline.run([jobspec], timeline_path))
+
+
+def _build_images(
+    jobspecs: List[JobSpec],
+    apispec: ApiSpec,
+    pool_size: int = POOL_SIZE,
+    workers: int = WORKERS,
+    policy: Optional[PollPolicy] = None,
+    upload_cache: Optional[UploadCache] = None,
+    build_cache: Optional[BuildCache] = None,
+    folder_cache: Optional[FolderCache] = None,
+    journal: Optional[RunJournal] = None,
+    recorder: Optional[RunRecorder] = None,
+    artifact_caches: Optional[List[ArtifactCache]] = None,
+    history: Optional[BuildHistory] = None,
+    follow: bool = False,
+    timeline_path: Optional[str] = None,
+):
+    """Synchronous wrapper building many images concurrently with BuildPipeline
+
+    Returns the names of the images that failed to build.
+    """
+    with RescaleClient(
+        apispec,
+        pool_size=max(pool_size, workers * UPLOAD_WORKERS, MAX_IN_FLIGHT),
+        recorder=recorder,
+    ) as client:
+        pipeline = BuildPipeline(
+            client,
+            policy,
+            workers=workers,
+            upload_cache=upload_cache,
+            build_cache=build_cache,
+            folder_cache=folder_cache or FolderCache(),
+            follow=follow,
+            journal=journal,
+            artifact_caches=artifact_caches,
+            history=history,
+        )
+        return asyncio.run(pipeline.run(jobspecs, timeline_path))
+
+
+def _submit_images(
+    jobspecs: List[JobSpec],
+    apispec: ApiSpec,
+    pool_size: int = POOL_SIZE,
+    workers: int = WORKERS,
+    upload_cache: Optional[UploadCache] = None,
+    build_cache: Optional[BuildCache] = None,
+    folder_cache: Optional[FolderCache] = None,
+    journal: Optional[RunJournal] = None,
+    recorder: Optional[RunRecorder] = None,
+    artifact_caches: Optional[List[ArtifactCache]] = None,
+) -> Tuple[Dict[str, Optional[str]], List[str]]:
+    """Upload, create and submit images without waiting for their jobs
+
+    Returns the job id per image name, None where a previous SIF was reused,
+    and the names of the images that failed to submit.
+    """
+    with RescaleClient(
+        apispec,
+        pool_size=max(pool_size, workers * UPLOAD_WORKERS, MAX_IN_FLIGHT),
+        recorder=recorder,
+    ) as client:
+        pipeline = BuildPipeline(
+            client,
+            workers=workers,
+            upload_cache=upload_cache,
+            build_cache=build_cache,
+            folder_cache=folder_cache or FolderCache(),
+            journal=journal,
+            detach=True,
+            artifact_caches=artifact_caches,
+        )
+        failed = asyncio.run(pipeline.run(jobspecs))
+        job_ids = {
+            jobspec.name: pipeline.job_ids[jobspec.name]
+            for jobspec in jobspecs
+            if jobspec.name in pipeline.job_ids
+        }
+        return job_ids, failed
+
+
+def _wait_for_jobs(
+    job_ids: List[str],
+    apispec: ApiSpec,
+    pool_size: int = POOL_SIZE,
+    policy: Optional[PollPolicy] = None,
+    follow: bool = False,
+    recorder: Optional[RunRecorder] = None,
+    journal: Optional[RunJournal] = None,
+) -> Dict[str, list]:
+    """Monitor already submitted jobs until all of them complete
+
+    Returns the status timeline of every job, keyed by job id. Jobs whose
+    status could not be checked are left out. The timelines are checkpointed
+    in the ``journal`` records of the builds, for ``finalize``.
+    """
+    with RescaleClient(
+        apispec, pool_size=max(pool_size, MAX_IN_FLIGHT), recorder=recorder
+    ) as client:
+        if follow:
+            policy = CappedPollPolicy(
+                policy or AdaptivePollPolicy(),
+                FOLLOW_INTERVAL,
+                (PHASE_RUNNING, PHASE_STAGING),
+            )
+        monitor = JobMonitor(client, policy)
+        for job_id in job_ids:
+            monitor.add(job_id, on_poll=_LogFollower(client) if follow else None)
+        with _span(client, "monitor"):
+            timelines = monitor.run()
+        for job_id, timeline in timelines.items():
+            if recorder is not None:
+                recorder.record_job(job_id, timeline)
+            record = journal.find(job_id) if journal is not None else None
+            if record is not None and not _stage_reached(record, "completed"):
+                _checkpoint(journal, record, "completed", timeline=timeline)
+        return timelines
+
+
+def _finalize_jobs(
+    job_ids: List[str],
+    apispec: ApiSpec,
+    pool_size: int = POOL_SIZE,
+    folder_cache: Optional[FolderCache] = None,
+    recorder: Optional[RunRecorder] = None,
+    journal: Optional[RunJournal] = None,
+    artifact_caches: Optional[List[ArtifactCache]] = None,
+    build_cache: Optional[BuildCache] = None,
+    history: Optional[BuildHistory] = None,
+) -> List[str]:
+    """Link the SIFs of completed jobs and display their process output
+
+    All SIFs are linked with one bulk call per endpoint. Jobs with a
+    ``journal`` record, i.e. submitted from this machine, then get the
+    bookkeeping of a full build: their artifact cache outputs are
+    registered, their fingerprint added to the build cache and, when
+    ``wait`` recorded their timeline, the run added to the build history.
+    Returns the ids of the jobs that are not completed yet or could not be
+    finalized.
+    """
+    failed = []
+    with RescaleClient(apispec, pool_size=pool_size, recorder=recorder) as client:
+        sif_job_ids = {}
+        for job_id in job_ids:
+            try:
+                job_status, _ = _fetch_statuses(job_id, client)
+                if job_status != "Completed":
+                    log.error("Job %s is not completed yet (%s)", job_id, job_status)
+                    failed.append(job_id)
+                    continue
+                sif_file_id = _find_sif_file_id(job_id, client)
+            except requests.RequestException as error:
+                log.error("Looking up job %s failed: %r", job_id, error)
+                failed.append(job_id)
+                continue
+            if sif_file_id is None:
+                log.error("Job %s has no single matching .sif file", job_id)
+                failed.append(job_id)
+                continue
+            sif_job_ids[sif_file_id] = job_id
+
+        with _span(client, "link"):
+            failures = _link_files_with_folder(
+                list(sif_job_ids), client, folder_cache
+            )
+        for file_id, error in failures.items():
+            job_id = sif_job_ids.pop(file_id)
+            log.error("Linking the SIF of job %s failed: %r", job_id, error)
+            failed.append(job_id)
+
+        for job_id in sif_job_ids.values():
+            if len(job_ids) > 1:
+                log.info("Process output of job %s", job_id)
+            with _span(client, "output"):
+                lines = _display_process_output(job_id, client)
+
+            record = journal.find(job_id) if journal is not None else None
+            if record is None or _stage_reached(record, "done"):
+                continue
+            for cache in artifact_caches or []:
+                key = record.get("cache_keys", {}).get(cache.archive)
+                try:
+                    cache.harvest(key, job_id, client)
+                except requests.RequestException as error:
+                    log.error(
+                        "Saving %s of job %s failed: %r", cache.archive, job_id, error
+                    )
+            if build_cache is not None:
+                build_cache.add(record["fingerprint"], job_id)
+            if history is not None and record.get("timeline") and record.get("jobspec"):
+                history.add(
+                    JobSpec(**record["jobspec"]),
+                    job_id,
+                    record["timeline"],
+                    _parse_build_usage(lines),
+                )
+            _checkpoint(journal, record, "done")
+    return failed
+
+
+def _jobspecs_from_args(args: dict, parser: argparse.ArgumentParser):
+    if args["manifest"]:
+        return _load_manifest(args["manifest"])
+
+    if not (args["deffile"] and args["buildscript"] and args["jobname"]):
+        parser.error(
+            "--deffile, --buildscript and --jobname are required without --manifest"
+        )
+    input_paths = list(args["input"])
+    if args["source_dir"]:
+        input_paths.append(_pack_source(args["source_dir"]))
+    return [
+        JobSpec(
+            args["jobname"],
+            args["deffile"],
+            args["buildscript"],
+            args["project"],
+            ANALYSIS_CODE,
+            ANALYSIS_VERSION,
+            args["coretype"],
+            args["core_count"],
+            args["walltime"],
+            tuple(input_paths),
+            args["compression"],
+        )
+    ]
+
+
+def _poll_policy_from_args(args: dict):
+    return AdaptivePollPolicy(
+        expected_runtime=args["expected_runtime"] * 60
+        if args["expected_runtime"]
+        else None
+    )
+
+
+COMMANDS = ("build", "submit", "wait", "finalize", "speedup")
 
 if __name__ == "__main__":
     _init_logging()
 
-    all_args = argparse.ArgumentParser()
+    api_args = argparse.ArgumentParser(add_help=False)
+    api_args.add_argument("-k", "--apikey", required=True, help="Rescale API Key")
+    api_args.add_argument(
+        "--pool-size",
+        type=int,
+        default=POOL_SIZE,
+        help="Maximum number of pooled keep-alive connections to the API host",
+    )
+    api_args.add_argument(
+        "--report",
+        default=None,
+        help="Write a JSON report of stage, HTTP call and job phase timings to "
+        "this file",
+    )
+    api_args.add_argument(
+        "--prometheus",
+        default=None,
+        help="Also write the timings as a Prometheus textfile collector file",
+    )
 
-    all_args.add_argument("-k", "--apikey", required=True, help="Rescale API Key")
-    all_args.add_argument(
-        "-d", "--deffile", required=True, help="Apptainer Image definition file"
+    image_args = argparse.ArgumentParser(add_help=False)
+    image_args.add_argument(
+        "-d", "--deffile", required=False, help="Apptainer Image definition file"
     )
-    all_args.add_argument(
-        "-s", "--buildscript", required=True, help="Image build script"
+    image_args.add_argument(
+        "-s", "--buildscript", required=False, help="Image build script"
     )
-    all_args.add_argument(
+    image_args.add_argument(
         "-n",
         "--jobname",
-        required=True,
+        required=False,
         default=None,
         help="Output name of the image sif file",
     )
-    all_args.add_argument(
+    image_args.add_argument(
+        "-i",
+        "--input",
+        action="append",
+        default=[],
+        help="Additional job input file, e.g. a source tarball (repeatable)",
+    )
+    image_args.add_argument(
+        "--coretype", default=CORETYPE, help="Rescale coretype of the build job"
+    )
+    image_args.add_argument(
+        "-c",
+        "--core-count",
+        type=int,
+        default=CORE_COUNT,
+        help="Cores of the build job, also used to parallelize compilation",
+    )
+    image_args.add_argument(
+        "--walltime", type=int, default=WALLTIME, help="Build job walltime in hours"
+    )
+    image_args.add_argument(
+        "--compression",
+        type=_parse_compression,
+        default=None,
+        help="SIF squashfs compression as ALGORITHM[:LEVEL], e.g. gzip:9, lz4 or "
+        "zstd:19 (default: the build script's)",
+    )
+    image_args.add_argument(
+        "--auto-size",
+        action="store_true",
+        help="Pick coretype, cores and walltime of each image from its build "
+        "history instead",
+    )
+    image_args.add_argument(
+        "--sizing-margin",
+        type=float,
+        default=SIZING_MARGIN,
+        help="Safety margin added to the measured memory, cores and duration "
+        "when auto-sizing",
+    )
+    image_args.add_argument(
+        "--source-dir",
+        default=None,
+        help=f"Local source tree uploaded pre-packed as {SOURCE_ARCHIVE} instead "
+        "of being fetched by the build script",
+    )
+    image_args.add_argument(
+        "-m",
+        "--manifest",
+        required=False,
+        help="JSON or YAML manifest listing several images to build concurrently "
+        "(replaces --deffile, --buildscript and --jobname)",
+    )
+    image_args.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="Number of images uploaded and submitted concurrently in manifest "
+        "mode",
+    )
+    image_args.add_argument(
         "-p",
         "--project",
         required=False,
         help="Optional Project Id for Jobs that need to be charged against a "
         "specific project.",
     )
+    image_args.add_argument(
+        "--no-upload-cache",
+        action="store_true",
+        help="Always upload the def file and build script, even when unchanged "
+        "since a previous run",
+    )
+    image_args.add_argument(
+        "--no-layer-cache",
+        action="store_true",
+        help=f"Neither attach nor save the {LAYER_CACHE_ARCHIVE} Apptainer layer "
+        "cache of the base image",
+    )
+    image_args.add_argument(
+        "--no-wheel-cache",
+        action="store_true",
+        help=f"Neither attach nor save the {WHEELHOUSE_ARCHIVE} pip wheelhouse",
+    )
+    image_args.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from the last completed stage instead "
+        "of uploading and submitting again",
+    )
+    image_args.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Build the image even when an identical build produced a SIF before",
+    )
 
-    args = vars(all_args.parse_args())
+    monitor_args = argparse.ArgumentParser(add_help=False)
+    monitor_args.add_argument(
+        "--expected-runtime",
+        type=float,
+        default=None,
+        help="Expected build run time in minutes, used to tighten status "
+        "polling near completion",
+    )
+    monitor_args.add_argument(
+        "--record-timeline",
+        default=None,
+        help="Write the observed job status timeline to this JSON file, keyed "
+        "by image name or job id when there are several",
+    )
+    monitor_args.add_argument(
+        "-f",
+        "--follow",
+        action="store_true",
+        help="Print the build process output while the job is running",
+    )
+
+    all_args = argparse.ArgumentParser(
+        description="Build Apptainer images on Rescale. Without a command the "
+        "whole build runs in one go."
+    )
+    commands = all_args.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "build",
+        parents=[api_args, image_args, monitor_args],
+        help="Submit, wait for and finalize builds (default)",
+    )
+    commands.add_parser(
+        "submit",
+        parents=[api_args, image_args],
+        help="Upload, create and submit builds, then print their job ids",
+    )
+    wait_args = commands.add_parser(
+        "wait",
+        parents=[api_args, monitor_args],
+        help="Monitor submitted build jobs until they complete",
+    )
+    wait_args.add_argument("job_ids", nargs="+", metavar="JOB_ID")
+    finalize_args = commands.add_parser(
+        "finalize",
+        parents=[api_args],
+        help="Link the SIFs of completed build jobs and display their output",
+    )
+    finalize_args.add_argument("job_ids", nargs="+", metavar="JOB_ID")
+    speedup_args = commands.add_parser(
+        "speedup",
+        help="Report the measured build speedup per core count of built images",
+    )
+    speedup_args.add_argument(
+        "-n", "--jobname", default=None, help="Only report this image"
+    )
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in COMMANDS + ("-h", "--help"):
+        argv = ["build", *argv]
+    args = vars(all_args.parse_args(argv))
+    if args["command"] == "speedup":
+        _print_speedup(BuildHistory(), args["jobname"])
+        sys.exit(0)
+
+    apispec = ApiSpec(BASE_HOST, args["apikey"])
+    recorder = None
+    if args["report"] or args["prometheus"]:
+        recorder = RunRecorder()
+        atexit.register(recorder.write, args["report"], args["prometheus"])
+
+    if args["command"] == "wait":
+        timelines = _wait_for_jobs(
+            args["job_ids"],
+            apispec,
+            pool_size=args["pool_size"],
+            policy=_poll_policy_from_args(args),
+            follow=args["follow"],
+            recorder=recorder,
+            journal=RunJournal(),
+        )
+        if args["record_timeline"]:
+            with open(args["record_timeline"], "w", encoding="utf-8") as file:
+                json.dump(
+                    timelines.get(args["job_ids"][0])
+                    if len(args["job_ids"]) == 1
+                    else timelines,
+                    file,
+                    indent=2,
+                )
+        failed_jobs = [job_id for job_id in args["job_ids"] if job_id not in timelines]
+        if failed_jobs:
+            log.info("Failed jobs: %s", ", ".join(failed_jobs))
+            sys.exit(1)
+        sys.exit(0)
+
+    if args["command"] == "finalize":
+        failed_jobs = _finalize_jobs(
+            args["job_ids"],
+            apispec,
+            pool_size=args["pool_size"],
+            folder_cache=FolderCache(),
+            recorder=recorder,
+            journal=RunJournal(),
+            artifact_caches=[
+                ArtifactCache(LAYER_CACHE_ARCHIVE, _layer_cache_key),
+                ArtifactCache(WHEELHOUSE_ARCHIVE, _wheelhouse_cache_key),
+            ],
+            build_cache=BuildCache(),
+            history=BuildHistory(),
+        )
+        if failed_jobs:
+            log.info("Failed jobs: %s", ", ".join(failed_jobs))
+            sys.exit(1)
+        sys.exit(0)
+
+    jobspecs = _jobspecs_from_args(args, all_args)
+    # Refused before anything is uploaded, rather than failing on the cluster
+    unpinned = [js.name for js in jobspecs if _fetches_unpinned_source(js)]
+    if unpinned:
+        all_args.error(
+            f"the build script of {', '.join(unpinned)} fetches sources without "
+            "pinning a full commit sha, set one in the script or pass --source-dir"
+        )
+    upload_cache = None if args["no_upload_cache"] else UploadCache()
+    build_cache = None if args["rebuild"] else BuildCache()
+    folder_cache = FolderCache()
+    journal = RunJournal(resume=args["resume"])
+    history = BuildHistory()
+    if args["auto_size"]:
+        jobspecs = _auto_size(jobspecs, apispec, history, args["sizing_margin"])
+    artifact_caches = []
+    if not args["no_layer_cache"]:
+        artifact_caches.append(ArtifactCache(LAYER_CACHE_ARCHIVE, _layer_cache_key))
+    if not args["no_wheel_cache"]:
+        artifact_caches.append(ArtifactCache(WHEELHOUSE_ARCHIVE, _wheelhouse_cache_key))
+
+    if args["command"] == "submit":
+        job_ids, failed_images = _submit_images(
+            jobspecs,
+            apispec,
+            pool_size=args["pool_size"],
+            workers=args["workers"],
+            upload_cache=upload_cache,
+            build_cache=build_cache,
+            folder_cache=folder_cache,
+            journal=journal,
+            recorder=recorder,
+            artifact_caches=artifact_caches,
+        )
+        for name, job_id in job_ids.items():
+            if job_id is not None:
+                print(f"{name}\t{job_id}")
+        if failed_images:
+            log.info("Failed images: %s", ", ".join(failed_images))
+            sys.exit(1)
+        sys.exit(0)
+
+    if args["manifest"]:
+        failed_images = _build_images(
+            jobspecs,
+            apispec,
+            pool_size=args["pool_size"],
+            workers=args["workers"],
+            policy=_poll_policy_from_args(args),
+            upload_cache=upload_cache,
+            build_cache=build_cache,
+            folder_cache=folder_cache,
+            journal=journal,
+            recorder=recorder,
+            artifact_caches=artifact_caches,
+            history=history,
+            follow=args["follow"],
+            timeline_path=args["record_timeline"],
+        )
+        if failed_images:
+            log.info("Failed images: %s", ", ".join(failed_images))
+            sys.exit(1)
+        sys.exit(0)
 
     _build_image(
-        JobSpec(
-            args["jobname"],
-            args["deffile"],
-            args["buildscript"],
-            args["project"],
-            ANALYSIS_CODE,
-            ANALYSIS_VERSION,
-            CORETYPE,
-            CORE_COUNT,
-            WALLTIME,
-        ),
-        ApiSpec(
-            BASE_HOST,
-            args["apikey"]
-        ),
+        jobspecs[0],
+        apispec,
+        pool_size=args["pool_size"],
+        policy=_poll_policy_from_args(args),
+        timeline_path=args["record_timeline"],
+        upload_cache=upload_cache,
+        build_cache=build_cache,
+        follow=args["follow"],
+        folder_cache=folder_cache,
+        journal=journal,
+        recorder=recorder,
+        artifact_caches=artifact_caches,
+        history=history,
     )
@@ -0,0 +1,380 @@
+"""Dockerfile to Apptainer def file converter
+
+Translates FROM, RUN, ADD/COPY, WORKDIR and ENV, plus LABEL, CMD and
+ENTRYPOINT, into a def file. All RUN steps are merged into one %post
+script that ends by removing package manager caches, and copied sources
+honour .dockerignore. Other instructions are skipped with a warning.
+"""
+
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import re
+import shlex
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Left out of copies when the build context has no .dockerignore
+DEFAULT_IGNORES = [".git"]
+
+# (command pattern in %post, cleanup appended to %post)
+PACKAGE_CACHES = [
+    (r"\bapt(?:-get)?\s", "apt-get clean\nrm -rf /var/lib/apt/lists/*"),
+    (r"\bpip3?\s", "rm -rf /root/.cache/pip"),
+    (r"\bconda\s", "conda clean --all --yes"),
+    (r"\byum\s", "yum clean all\nrm -rf /var/cache/yum"),
+    (r"\bdnf\s", "dnf clean all"),
+    (r"\bapk\s", "rm -rf /var/cache/apk/*"),
+]
+
+
+class Instruction(NamedTuple):
+    """One Dockerfile instruction with its line number"""
+
+    keyword: str
+    arguments: str
+    line: int
+
+
+def _parse_dockerfile(text: str) -> List[Instruction]:
+    """Split a Dockerfile into instructions, joining continuation lines"""
+    instructions = []
+    lines: List[str] = []
+    start = 0
+    for number, raw in enumerate(text.splitlines(), 1):
+        stripped = raw.strip()
+        if not lines and (not stripped or stripped.startswith("#")):
+            continue
+        if lines and stripped.startswith("#"):
+            continue
+        if not lines:
+            start = number
+        if stripped.endswith("\\"):
+            lines.append(stripped[:-1].rstrip())
+            continue
+        lines.append(stripped)
+
+        keyword, _, arguments = lines[0].partition(" ")
+        body = "\n".join([arguments.strip(), *lines[1:]]).strip()
+        instructions.append(Instruction(keyword.upper(), body, start))
+        lines = []
+    if lines:
+        raise ValueError(f"Line {start}: unterminated line continuation")
+    return instructions
+
+
+def _exec_form(arguments: str) -> Optional[List[str]]:
+    """Arguments of a JSON exec form instruction, None for the shell form"""
+    if not arguments.startswith("["):
+        return None
+    try:
+        return json.loads(arguments.replace("\n", " "))
+    except json.JSONDecodeError:
+        return None
+
+
+def _parse_env(arguments: str) -> List[Tuple[str, str]]:
+    """``ENV key=value ...`` pairs, or the legacy ``ENV key value`` form"""
+    words = shlex.split(arguments.replace("\n", " "))
+    if words and "=" not in words[0]:
+        return [(words[0], " ".join(words[1:]))]
+    return [tuple(word.split("=", 1)) for word in words]
+
+
+def _quote_env(value: str) -> str:
+    """Double-quote an ENV value, keeping references to other variables"""
+    return '"' + re.sub(r'(["\\\\`])', r"\\\1", value) + '"'
+
+
+def _quote_path(path: str) -> str:
+    """%files path, double-quoted when it contains spaces or quotes"""
+    if not re.search(r"[\s\"'\\\\]", path):
+        return path
+    return '"' + re.sub(r'(["\\\\])', r"\\\1", path) + '"'
+
+
+class DockerIgnore:
+    """Matcher for the .dockerignore patterns of a build context
+
+    Patterns are matched against paths relative to the context, a path is
+    ignored when it or one of its parent directories matches. ``**``
+    matches any number of directories and later ``!`` patterns re-include
+    what earlier patterns excluded.
+    """
+
+    def __init__(self, patterns: List[str]):
+        self.rules = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            include = pattern.startswith("!")
+            pattern = os.path.normpath(pattern.lstrip("!").strip()).lstrip("/")
+            self.rules.append((re.compile(self._regex(pattern)), include))
+
+    @classmethod
+    def from_context(cls, context_dir: str) -> "DockerIgnore":
+        path = os.path.join(context_dir, ".dockerignore")
+        if not os.path.exists(path):
+            return cls(DEFAULT_IGNORES)
+        with open(path, encoding="utf-8") as file:
+            return cls(file.read().splitlines())
+
+    @staticmethod
+    def _regex(pattern: str) -> str:
+        parts = []
+        for index, segment in enumerate(pattern.split("/")):
+            if segment == "**":
+                parts.append("(?:.*/)?" if index == 0 else "(?:/.*)?")
+                continue
+            segment = fnmatch.translate(segment)[4:-3].replace(".*", "[^/]*")
+            if index and not parts[-1].endswith("?"):
+                segment = "/" + segment
+            parts.append(segment)
+        return "".join(parts) + "(?:/.*)?"
+
+    def ignored(self, path: str) -> bool:
+        ignored = False
+        for regex, include in self.rules:
+            if regex.fullmatch(path):
+                ignored = not include
+        return ignored
+
+
+def _copy_entries(
+    sources: List[str], dest: str, context_dir: str, ignore: DockerIgnore
+) -> List[Tuple[str, str]]:
+    """(source, destination) %files entries of an ADD/COPY
+
+    Docker copies the contents of a source directory into the destination,
+    so a directory is listed entry by entry. Directories without ignored
+    files inside are kept as one entry, others are expanded further.
+    """
+    entries = []
+
+    def add(relpath: str, target: str):
+        if ignore.ignored(relpath):
+            return
+        path = os.path.join(context_dir, relpath)
+        if not os.path.isdir(path):
+            entries.append((relpath, target))
+            return
+        if not any(
+            ignore.ignored(os.path.relpath(os.path.join(root, name), context_dir))
+            for root, dirs, files in os.walk(path)
+            for name in dirs + files
+        ):
+            entries.append((relpath, target))
+            return
+        for child in sorted(os.listdir(path)):
+            add(os.path.normpath(os.path.join(relpath, child)), f"{target}/{child}")
+
+    for source in sources:
+        relpath = os.path.normpath(source).lstrip("/")
+        if re.match(r"^[a-z]+://", source):
+            raise ValueError(f"Remote sources are not supported: {source}")
+        path = os.path.join(context_dir, relpath)
+        if not os.path.exists(path):
+            raise ValueError(f"{source} not found in {context_dir}")
+        if os.path.isdir(path):
+            for child in sorted(os.listdir(path)):
+                target = f"{dest.rstrip('/')}/{child}"
+                add(os.path.normpath(os.path.join(relpath, child)), target)
+        elif dest.endswith("/") or len(sources) > 1:
+            add(relpath, f"{dest.rstrip('/')}/{os.path.basename(relpath)}")
+        else:
+            add(relpath, dest)
+    return entries
+
+
+def convert(
+    dockerfile_path: str,
+    context_dir: Optional[str] = None,
+    base_workdir: Optional[str] = None,
+) -> str:
+    """Apptainer def file equivalent of a Dockerfile
+
+    ``context_dir`` defaults to the directory of the Dockerfile, %files
+    paths are relative to it so the image is built from there. Only the
+    last stage of a multi-stage Dockerfile is converted. As %files runs
+    before %post, sources copied after a RUN are already present when it
+    runs.
+
+    ``base_workdir`` is the WORKDIR set by the base image, which Apptainer
+    ignores. Until a WORKDIR instruction sets it, an unknown one is assumed
+    to be where the preceding ADD/COPY copied to, with a warning.
+    """
+    context_dir = context_dir or os.path.dirname(os.path.abspath(dockerfile_path))
+    with open(dockerfile_path, encoding="utf-8") as file:
+        instructions = _parse_dockerfile(file.read())
+    stages = [i for i, inst in enumerate(instructions) if inst.keyword == "FROM"]
+    if not stages:
+        raise ValueError("No FROM instruction found")
+    if len(stages) > 1:
+        log.warning("Multi-stage Dockerfile, only converting the last stage")
+    instructions = instructions[stages[-1] :]
+
+    ignore = DockerIgnore.from_context(context_dir)
+    base_image = instructions[0].arguments.split()[0]
+    files: List[Tuple[str, str]] = []
+    post: List[str] = []
+    environment: Dict[str, str] = {}
+    labels: Dict[str, str] = {}
+    runscript: Optional[str] = None
+    entrypoint: List[str] = []
+    workdir = base_workdir or "/"
+    workdir_known = base_workdir is not None
+    if workdir != "/":
+        post.append(f"cd {shlex.quote(workdir)}")
+
+    copied_to = None
+    warned_workdir = False
+    for inst in instructions[1:]:
+        if inst.keyword in ("RUN", "CMD", "ENTRYPOINT") and not workdir_known:
+            if copied_to not in (None, workdir):
+                log.warning(
+                    "Line %d: the base image WORKDIR is unknown, assuming %s "
+                    "where the preceding ADD/COPY copied to (set it with "
+                    "--workdir)",
+                    inst.line,
+                    copied_to,
+                )
+                workdir = copied_to
+                post.append(f"cd {shlex.quote(workdir)}")
+            elif not warned_workdir and copied_to is None:
+                log.warning(
+                    "Line %d: the base image WORKDIR is unknown, assuming / "
+                    "(set it with --workdir)",
+                    inst.line,
+                )
+            warned_workdir = True
+        if inst.keyword == "RUN":
+            words = _exec_form(inst.arguments)
+            command = shlex.join(words) if words else inst.arguments
+            post.append(command.replace("\n", " \\\n    "))
+        elif inst.keyword in ("ADD", "COPY"):
+            arguments = inst.arguments.replace("\n", " ")
+            flags = re.findall(r"--\S+", arguments.split("[", 1)[0])
+            if any(flag.startswith("--from") for flag in flags):
+                raise ValueError(f"Line {inst.line}: COPY --from is not supported")
+            if flags:
+                log.warning("Line %d: ignoring %s", inst.line, " ".join(flags))
+            arguments = arguments.split(flags[-1], 1)[1] if flags else arguments
+            arguments = arguments.strip()
+            *sources, dest = _exec_form(arguments) or shlex.split(arguments)
+            if inst.keyword == "ADD" and any(
+                re.search(r"\.(tar|tgz|tar\.\w+)$", source) for source in sources
+            ):
+                log.warning("Line %d: archives are copied, not extracted", inst.line)
+            if not workdir_known and not dest.startswith("/"):
+                log.warning(
+                    "Line %d: the base image WORKDIR is unknown, copying to %s "
+                    "relative to %s (set it with --workdir)",
+                    inst.line,
+                    dest,
+                    workdir,
+                )
+            directory = "/" if dest.endswith(("/", ".")) else ""
+            dest = os.path.normpath(os.path.join(workdir, dest)).rstrip("/")
+            copied_to = dest or "/"
+            if not directory and len(sources) == 1:
+                source = os.path.normpath(sources[0]).lstrip("/")
+                if not os.path.isdir(os.path.join(context_dir, source)):
+                    copied_to = os.path.dirname(dest) or "/"
+            dest += directory
+            files.extend(_copy_entries(sources, dest, context_dir, ignore))
+        elif inst.keyword == "WORKDIR":
+            workdir = os.path.join(workdir, inst.arguments.strip())
+            workdir_known = True
+            quoted = shlex.quote(workdir)
+            post.append(f"mkdir -p {quoted}\ncd {quoted}")
+        elif inst.keyword == "ENV":
+            for key, value in _parse_env(inst.arguments):
+                environment[key] = value
+                post.append(f"export {key}={_quote_env(value)}")
+        elif inst.keyword == "LABEL":
+            for key, value in _parse_env(inst.arguments):
+                labels[key] = value
+        elif inst.keyword == "ENTRYPOINT":
+            words = _exec_form(inst.arguments)
+            entrypoint = words or ["/bin/sh", "-c", inst.arguments]
+        elif inst.keyword == "CMD":
+            words = _exec_form(inst.arguments)
+            if not words:
+                words = ["/bin/sh", "-c", inst.arguments]
+            runscript = shlex.join(words)
+        else:
+            log.warning("Line %d: skipping unsupported %s", inst.line, inst.keyword)
+
+    script = "\n".join(post)
+    for pattern, cleanup in PACKAGE_CACHES:
+        if re.search(pattern, script):
+            post.append(cleanup)
+
+    sections = [f"Bootstrap: docker\nFrom: {base_image}\n"]
+    if files:
+        entries = "".join(
+            f"  {_quote_path(src)} {_quote_path(dest)}\n" for src, dest in files
+        )
+        sections.append(f"%files\n{entries}")
+    if environment:
+        sections.append(
+            "%environment\n"
+            + "".join(f"  export {k}={_quote_env(v)}\n" for k, v in environment.items())
+        )
+    if post:
+        steps = [step.replace("\n", "\n  ") for step in post]
+        sections.append("%post\n" + "".join(f"  {step}\n" for step in steps))
+    if labels:
+        entries = "".join(f"  {key} {value}\n" for key, value in labels.items())
+        sections.append(f"%labels\n{entries}")
+    if entrypoint or runscript:
+        # Like Docker, run arguments replace CMD and are passed to ENTRYPOINT
+        lines = [f"cd {shlex.quote(workdir)}"]
+        if entrypoint and runscript:
+            lines.append(f"[ $# -gt 0 ] || set -- {runscript}")
+        if entrypoint:
+            lines.append(f'exec {shlex.join(entrypoint)} "$@"')
+        else:
+            lines.append(f'[ $# -gt 0 ] && exec "$@"\nexec {runscript}')
+        body = "\n".join(lines).replace("\n", "\n  ")
+        sections.append(f"%runscript\n  {body}\n")
+    return "\n".join(sections)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s: %(message)s")
+
+    all_args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    all_args.add_argument("dockerfile", help="Dockerfile to convert")
+    all_args.add_argument(
+        "-c",
+        "--context",
+        default=None,
+        help="Build context directory (default: the Dockerfile directory)",
+    )
+    all_args.add_argument(
+        "-w",
+        "--workdir",
+        default=None,
+        help="WORKDIR set by the base image, which Apptainer ignores (default: "
+        "where the preceding ADD/COPY copied to, or /)",
+    )
+    all_args.add_argument(
+        "-o", "--output", default=None, help="Def file to write (default: stdout)"
+    )
+    args = vars(all_args.parse_args())
+
+    try:
+        deffile = convert(args["dockerfile"], args["context"], args["workdir"])
+    except ValueError as error:
+        all_args.exit(1, f"{error}\n")
+    if args["output"]:
+        with open(args["output"], "w", encoding="utf-8") as file:
+            file.write(deffile)
+    else:
+        sys.stdout.write(deffile)
@@ -0,0 +1,429 @@
+"""Local stand-in for the subset of the Rescale API used by build_image.py
+
+Only meant for benchmarking the builder without a live Rescale account.
+By default every endpoint answers instantly and jobs complete as soon as they
+are submitted. Responses can be delayed by a configurable latency, requests
+can be failed or dropped by injected failures, and submitted jobs can follow
+a simulated status timeline. Uploads can be made to fail mid-body to
+exercise retries.
+"""
+
+import itertools
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+PROCESS_OUTPUT = [
+    "Building image...\n",
+    "INFO:    Build complete\n",
+    "BUILD_USAGE cores=2 build_seconds=600 peak_memory_mb=5120 "
+    "cpu_utilization=0.45\n",
+]
+CORETYPES = [
+    {"code": "emerald", "name": "Emerald", "memory": 3750, "cores": [1, 2, 4, 8, 16]},
+    {"code": "onyx", "name": "Onyx", "memory": 4000, "cores": [1, 2, 4, 8, 18, 36]},
+]
+# Request bodies are consumed in chunks, only their head is kept in memory
+BODY_CHUNK = 1 << 16
+# (elapsed seconds since submit, job status, cluster status)
+INSTANT_TIMELINE = [(0, "Completed", "Stopped")]
+
+
+class _State:
+    """In-memory API state plus request/connection counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.jobs = {}
+        self.folders = {}
+        self.connections = 0
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Number of upcoming uploads to cut off after drop_after body bytes
+        self.drop_uploads = 0
+        self.drop_after = 0
+        # Seconds added to every response, uniformly varied by +-jitter
+        self.latency = 0.0
+        self.latency_jitter = 0.0
+        self.failures = []
+        # Status timeline followed by every submitted job, time_scale times
+        # faster than real time
+        self.timeline = list(INSTANT_TIMELINE)
+        self.time_scale = 1.0
+        self.clock = time.monotonic
+
+    def new_id(self, prefix: str):
+        with self.lock:
+            return f"{prefix}{next(self.ids)}"
+
+    def inject_failure(
+        self,
+        method: str,
+        pattern: str,
+        status=503,
+        times: int = 1,
+        retry_after=None,
+        processed: bool = False,
+    ):
+        """Fail the next ``times`` requests matching ``method`` and ``pattern``
+
+        ``pattern`` is a regex matched against the whole path. A ``status`` of
+        None drops the connection without a response. With ``processed`` the
+        request takes effect before its response is failed or dropped.
+        """
+        with self.lock:
+            self.failures.append(
+                {
+                    "method": method,
+                    "pattern": pattern,
+                    "status": status,
+                    "remaining": times,
+                    "retry_after": retry_after,
+                    "processed": processed,
+                }
+            )
+
+    def take_failure(self, method: str, path: str):
+        with self.lock:
+            for failure in self.failures:
+                if (
+                    failure["remaining"] > 0
+                    and failure["method"] == method
+                    and re.fullmatch(failure["pattern"], path)
+                ):
+                    failure["remaining"] -= 1
+                    return failure
+        return None
+
+    def job_statuses(self, job):
+        """Timeline entries the job has reached so far, oldest first"""
+        if job.get("submitted") is None:
+            return [(0, "Pending", None)]
+        elapsed = (self.clock() - job["submitted"]) * self.time_scale
+        reached = [entry for entry in self.timeline if entry[0] <= elapsed]
+        return reached or [(0, "Pending", None)]
+
+    def reset_counters(self):
+        with self.lock:
+            self.connections = 0
+            self.requests = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state: _State = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _read_body(self, limit=None):
+        """Consume the request body, keeping at most BODY_CHUNK bytes of it
+
+        Returns None when ``limit`` bytes were read and the connection was
+        dropped on purpose.
+        """
+        length = int(self.headers.get("Content-Length") or 0)
+        head, received = b"", 0
+        while received < length:
+            chunk = self.rfile.read(min(BODY_CHUNK, length - received))
+            if not chunk:
+                break
+            received += len(chunk)
+            if len(head) < BODY_CHUNK:
+                head += chunk[: BODY_CHUNK - len(head)]
+            if limit is not None and received >= limit:
+                break
+        with self.state.lock:
+            self.state.requests += 1
+            self.state.bytes_in += received
+        if limit is not None and received >= limit:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return None
+        return head
+
+    def _drop_limit(self, method: str, path: str):
+        if method != "POST" or path != "/api/v2/files/contents/":
+            return None
+        with self.state.lock:
+            if self.state.drop_uploads <= 0:
+                return None
+            self.state.drop_uploads -= 1
+            return self.state.drop_after
+
+    def _reply(self, status: int, payload=None, headers=None):
+        body = json.dumps({} if payload is None else payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.state.lock:
+            self.state.bytes_out += len(body)
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        body = self._read_body(self._drop_limit(method, url.path))
+        if body is None:
+            return
+        if self.state.latency:
+            time.sleep(
+                max(
+                    0.0,
+                    self.state.latency
+                    + random.uniform(-1, 1) * self.state.latency_jitter,
+                )
+            )
+
+        failure = self.state.take_failure(method, url.path)
+        status, payload = 404, {"detail": "Not found."}
+        if failure is None or failure["processed"]:
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            for route_method, pattern, handler in _ROUTES:
+                match = re.fullmatch(pattern, url.path)
+                if route_method == method and match:
+                    status, payload = handler(
+                        self.state, body, query, *match.groups()
+                    )
+                    break
+
+        if failure is None:
+            self._reply(status, payload)
+        elif failure["status"] is None:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+        else:
+            headers = {}
+            if failure["retry_after"] is not None:
+                headers["Retry-After"] = str(failure["retry_after"])
+            self._reply(failure["status"], {"detail": "Injected failure."}, headers)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._dispatch("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._dispatch("POST")
+
+
+def _page(results, query, path):
+    """Slice results the way paginated Rescale listings do"""
+    page = int(query.get("page", 1))
+    page_size = int(query.get("page_size", 10))
+    start = (page - 1) * page_size
+    params = {k: v for k, v in query.items() if k != "page"}
+    params["page"] = page + 1
+    next_url = None
+    if start + page_size < len(results):
+        next_url = f"http://fake{path}?{urlencode(params)}"
+    return {
+        "count": len(results),
+        "next": next_url,
+        "results": results[start : start + page_size],
+    }
+
+
+def _upload(state, body, _query):
+    match = re.search(rb'filename="([^"]+)"', body)
+    name = match.group(1).decode() if match else "upload"
+    file_id = state.new_id("f")
+    state.files[file_id] = {"id": file_id, "name": name, "lines": []}
+    return 201, {"id": file_id, "name": name}
+
+
+def _create_job(state, body, _query):
+    job_id = state.new_id("j")
+    state.jobs[job_id] = {
+        "id": job_id,
+        "spec": json.loads(body),
+        "outputs": [],
+        "submitted": None,
+    }
+    return 201, {"id": job_id}
+
+
+def _list_jobs(state, _body, query):
+    search = query.get("search", "")
+    results = [
+        {
+            "id": job["id"],
+            "name": job["spec"]["name"],
+            "description": job["spec"].get("description", ""),
+        }
+        for job in state.jobs.values()
+        if search in job["spec"]["name"]
+    ]
+    return 200, _page(results, query, "/api/v2/jobs/")
+
+
+def _submit_job(state, _body, _query, job_id):
+    job = state.jobs.get(job_id)
+    if job is None:
+        return 404, None
+    if job["submitted"] is not None:
+        return 400, {"detail": "Job already submitted."}
+    job["submitted"] = state.clock()
+    for name, lines in (("image.sif", []), ("process_output.log", PROCESS_OUTPUT)):
+        file_id = state.new_id("f")
+        state.files[file_id] = {"id": file_id, "name": name, "lines": lines}
+        job["outputs"].append(file_id)
+    return 200, None
+
+
+def _job_statuses(state, _body, _query, job_id):
+    job = state.jobs.get(job_id)
+    if job is None:
+        return 404, None
+    # Newest first, like the Rescale API
+    reached = state.job_statuses(job)
+    statuses = list(dict.fromkeys(status for _, status, _ in reversed(reached)))
+    return 200, {"results": [{"status": status} for status in statuses]}
+
+
+def _cluster_statuses(state, _body, _query, job_id):
+    job = state.jobs.get(job_id)
+    if job is None:
+        return 404, None
+    reached = [entry for entry in state.job_statuses(job) if entry[2] is not None]
+    if not reached:
+        return 404, None
+    return 200, {"results": [{"status": reached[-1][2]}]}
+
+
+def _job_files(state, _body, query, job_id):
+    job = state.jobs.get(job_id)
+    if job is None:
+        return 404, None
+    # Outputs are only staged off the cluster once the job completed
+    if state.job_statuses(job)[-1][1] != "Completed":
+        return 200, _page([], query, f"/api/v2/jobs/{job_id}/files/")
+    search = query.get("search", "")
+    results = [
+        {"id": state.files[f]["id"], "name": state.files[f]["name"]}
+        for f in job["outputs"]
+        if search in state.files[f]["name"]
+    ]
+    return 200, _page(results, query, f"/api/v2/jobs/{job_id}/files/")
+
+
+def _tail(state, _body, query, job_id, _run_id, path):
+    job = state.jobs.get(job_id)
+    if job is None:
+        return 404, None
+    for file_id in job["outputs"]:
+        if state.files[file_id]["name"] == path:
+            count = int(query.get("lines", 100))
+            return 200, {"lines": state.files[file_id]["lines"][-count:]}
+    return 404, None
+
+
+def _list_folders(state, _body, _query):
+    return 200, list(state.folders.values())
+
+
+def _create_folder(state, body, _query):
+    name = json.loads(body)["name"]
+    for folder in state.folders.values():
+        if folder["name"] == name:
+            return 400, {"id": folder["id"]}
+    folder_id = state.new_id("d")
+    state.folders[folder_id] = {"id": folder_id, "name": name}
+    return 201, {"id": folder_id}
+
+
+def _assign_folder(state, _body, _query, folder_id):
+    if folder_id not in state.folders:
+        return 404, None
+    return 200, None
+
+
+def _type_change(_state, _body, _query):
+    return 200, None
+
+
+def _list_coretypes(_state, _body, query):
+    return 200, _page(CORETYPES, query, "/api/v2/coretypes/")
+
+
+def _file_info(state, _body, _query, file_id):
+    file = state.files.get(file_id)
+    if file is None:
+        return 404, None
+    return 200, {"id": file["id"], "name": file["name"], "isDeleted": False}
+
+
+def _file_lines(state, _body, _query, file_id):
+    file = state.files.get(file_id)
+    if file is None:
+        return 404, None
+    return 200, {"lines": file["lines"]}
+
+
+_ROUTES = [
+    ("POST", r"/api/v2/files/contents/", _upload),
+    ("GET", r"/api/v2/jobs/", _list_jobs),
+    ("POST", r"/api/v2/jobs/", _create_job),
+    ("POST", r"/api/v2/jobs/(\w+)/submit/", _submit_job),
+    ("GET", r"/api/v2/jobs/(\w+)/statuses/", _job_statuses),
+    ("GET", r"/api/v2/jobs/(\w+)/cluster_statuses/", _cluster_statuses),
+    ("GET", r"/api/v2/jobs/(\w+)/files/", _job_files),
+    ("GET", r"/api/v2/jobs/(\w+)/runs/(\d+)/tail/([\w.]+)", _tail),
+    ("GET", r"/api/v3/file-folders/", _list_folders),
+    ("POST", r"/api/v3/file-folders/", _create_folder),
+    ("POST", r"/api/v3/file-folders/(\w+)/files/", _assign_folder),
+    ("POST", r"/api/v3/files/bulk/type-change/", _type_change),
+    ("GET", r"/api/v2/coretypes/", _list_coretypes),
+    ("GET", r"/api/v2/files/(\w+)/", _file_info),
+    ("GET", r"/api/v2/files/(\w+)/lines/", _file_lines),
+]
+
+
+class FakeRescaleServer:
+    """Threaded stand-in API server bound to a local ephemeral port"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        timeline=None,
+        time_scale: float = 1.0,
+    ):
+        self.state = _State()
+        self.state.latency = latency
+        self.state.timeline = sorted(timeline or INSTANT_TIMELINE)
+        self.state.time_scale = time_scale
+        handler = type("Handler", (_Handler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def basehost(self):
+        host, port = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()